@@ -0,0 +1,912 @@
+import math
+import numpy as np
+
+# Values of the clearance bitmap
+FREE = 0
+BLOCKED = 1
+BORDER = 2
+
+# Heading offsets and speed fractions that avoidObstacle tries, in order of priority
+ANGLE_LIST = [10, -10, 20, -20, 30, -30, 40, -40, 50, -50, 60, -60, 70, -70, 80, -80, 90, -90, 100, -100,
+              110, -110, 120, -120, 130, -130, 140, -140, 150, -150, 160, -160, 170, -170, 180, -180]
+MAGNITUDE_LIST = [1.0, 0.8, 0.6, 0.4, 0.2]
+
+# Rotation table: cos and sin of every offset, repeated for every magnitude
+ROTATION_COS = np.tile(np.cos(np.radians(ANGLE_LIST)), len(MAGNITUDE_LIST))
+ROTATION_SIN = np.tile(np.sin(np.radians(ANGLE_LIST)), len(MAGNITUDE_LIST))
+MAGNITUDES = np.repeat(MAGNITUDE_LIST, len(ANGLE_LIST))
+
+# Up to this many points a proximity check pairs every query point with every point, the cell lookup does not pay off
+DENSE_LIMIT = 32
+
+class ObstacleSet:
+    def __init__(self, width, height, obstacles=(), cell_size=10, bitmap_resolution=None, field_resolution=2):
+        """Initialization of the ObstacleSet class.
+        The obstacles are stored as contiguous arrays, so many points can be tested against all of them at once.
+        A spatial hash of square buckets maps every bucket to the obstacles that overlap it, 
+        so a query only has to test the obstacles near the query circle.
+        If a bitmap resolution is given, collision tests are answered from a clearance bitmap per radius,
+        and only fall back to the exact test for the pixels on the border of an obstacle.
+
+        Args:
+            width (int): width of the grid
+            height (int): height of the grid
+            obstacles (list, optional): obstacles as [x, y, half_width, half_height]. Defaults to ().
+            cell_size (float, optional): width and height of a bucket of the spatial hash. Defaults to 10.
+            bitmap_resolution (int, optional): pixels of the clearance bitmap per unit of length, None to always do the exact test. Defaults to None.
+            field_resolution (int, optional): pixels of the signed distance field per unit of length. Defaults to 2.
+        """
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        self.buckets = {}
+        self.bitmap_resolution = bitmap_resolution
+        self.bitmaps = {}
+        self.field_resolution = field_resolution
+        self.field = None
+        self.version = 0
+        self.count = 0
+        self.capacity = max(16, len(obstacles))
+        self.x = np.empty(self.capacity)
+        self.y = np.empty(self.capacity)
+        self.half_width = np.empty(self.capacity)
+        self.half_height = np.empty(self.capacity)
+
+        for x, y, half_width, half_height in obstacles:
+            self.add(x, y, half_width, half_height)
+
+    def add(self, x, y, half_width, half_height):
+        """Function that adds an obstacle, doubling the arrays when they are full
+
+        Args:
+            x (float): x coordinate of the obstacle
+            y (float): y coordinate of the obstacle
+            half_width (float): half of the width of the obstacle
+            half_height (float): half of the height of the obstacle
+        """
+        if self.count == self.capacity:
+            self.capacity *= 2
+            for name in ['x', 'y', 'half_width', 'half_height']:
+                array = np.empty(self.capacity)
+                array[:self.count] = getattr(self, name)[:self.count]
+                setattr(self, name, array)
+
+        self.x[self.count] = x
+        self.y[self.count] = y
+        self.half_width[self.count] = half_width
+        self.half_height[self.count] = half_height
+        self.bitmaps = {}
+        self.field = None
+        self.version += 1
+
+        # Register the obstacle in every bucket its rectangle touches
+        cx_min, cx_max, cy_min, cy_max = self.cell_range(x - half_width, x + half_width, y - half_height, y + half_height)
+        for cx in range(cx_min, cx_max + 1):
+            for cy in range(cy_min, cy_max + 1):
+                self.buckets.setdefault((cx, cy), []).append(self.count)
+        self.count += 1
+
+    def cell_range(self, x_min, x_max, y_min, y_max):
+        """Function that computes the range of buckets covered by a box
+
+        Args:
+            x_min (float): left side of the box
+            x_max (float): right side of the box
+            y_min (float): bottom side of the box
+            y_max (float): top side of the box
+
+        Returns:
+            int: first and last bucket column, first and last bucket row
+        """
+        return (math.floor(x_min / self.cell_size), math.floor(x_max / self.cell_size),
+                math.floor(y_min / self.cell_size), math.floor(y_max / self.cell_size))
+
+    def candidates(self, x_min, x_max, y_min, y_max):
+        """Function that returns the obstacles in the buckets covered by a box
+
+        Args:
+            x_min (float): left side of the box
+            x_max (float): right side of the box
+            y_min (float): bottom side of the box
+            y_max (float): top side of the box
+
+        Returns:
+            array: indices of the obstacles that may overlap the box
+        """
+        cx_min, cx_max, cy_min, cy_max = self.cell_range(x_min, x_max, y_min, y_max)
+        if (cx_max - cx_min + 1) * (cy_max - cy_min + 1) >= len(self.buckets):
+            return np.arange(self.count)
+
+        found = []
+        for cx in range(cx_min, cx_max + 1):
+            for cy in range(cy_min, cy_max + 1):
+                bucket = self.buckets.get((cx, cy))
+                if bucket:
+                    found.extend(bucket)
+
+        if len(found) > 1:
+            return np.unique(found)
+        return np.array(found, dtype=int)
+
+    def out_of_bounds(self, px, py, radius):
+        """Check which circles stick out of the grid
+
+        Args:
+            px (array): x coordinates of the points
+            py (array): y coordinates of the points
+            radius (float): radius of the circles
+
+        Returns:
+            array: True for every circle that is not completely inside the grid
+        """
+        return (px - radius < 0) | (px + radius > self.width) | (py - radius < 0) | (py + radius > self.height)
+
+    def query(self, points, radius, idx=None):
+        """Check for many points (x,y) with given radius if they collide with the border or any obstacle
+
+        Args:
+            points (array): array of shape (n, 2) with the x and y coordinates of the points
+            radius (float): sensing range of the agent
+            idx (array, optional): the obstacles that can be hit, such as a Verlet list. Defaults to None, search the spatial hash.
+
+        Returns:
+            array: boolean array of shape (n,), True if there is a collision
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        px = points[:, 0]
+        py = points[:, 1]
+        hit = self.out_of_bounds(px, py, radius)
+
+        if self.count == 0 or hit.all():
+            return hit
+
+        if self.bitmap_resolution is None:
+            return hit | self.exact_query(px, py, radius, idx)
+
+        # Look up the points that are inside the grid, and only do the exact test on the border pixels
+        inside = np.flatnonzero(~hit)
+        state = self.lookup(px[inside], py[inside], radius)
+        hit[inside[state == BLOCKED]] = True
+        border = inside[state == BORDER]
+        if len(border) > 0:
+            hit[border] = self.exact_query(px[border], py[border], radius, idx)
+        return hit
+
+    def exact_query(self, px, py, radius, idx=None):
+        """Geometric test of many points (x,y) with given radius against the obstacles, ignoring the border
+
+        Args:
+            px (array): x coordinates of the points
+            py (array): y coordinates of the points
+            radius (float): sensing range of the agent
+            idx (array, optional): the obstacles that can be hit. Defaults to None, search the spatial hash.
+
+        Returns:
+            array: boolean array, True if the point collides with an obstacle
+        """
+        if idx is None:
+            idx = self.candidates(px.min() - radius, px.max() + radius, py.min() - radius, py.max() + radius)
+        if len(idx) == 0:
+            return np.zeros(len(px), dtype=bool)
+
+        ox = self.x[idx]
+        oy = self.y[idx]
+        ow = self.half_width[idx]
+        oh = self.half_height[idx]
+
+        # Closest point on every rectangle to every circle center, shape (points, obstacles)
+        closest_x = np.maximum(ox - ow, np.minimum(px[:, None], ox + ow))
+        closest_y = np.maximum(oy - oh, np.minimum(py[:, None], oy + oh))
+
+        dx = px[:, None] - closest_x
+        dy = py[:, None] - closest_y
+        distance = np.sqrt(dx * dx + dy * dy)
+
+        return (distance < radius).any(axis=1)
+
+    def collides(self, x, y, radius, idx=None):
+        """Check if a point (x,y) with given radius collides with the border or any obstacle
+
+        Args:
+            x (float): x coordinate of the agent
+            y (float): y coordinate of the agent
+            radius (float): sensing range of the agent
+            idx (array, optional): the obstacles that can be hit, such as a Verlet list. Defaults to None, search the spatial hash.
+
+        Returns:
+            Bool: True if there is a collision, false otherwise
+        """
+        # Check bounds
+        if x - radius < 0 or x + radius > self.width or y - radius < 0 or y + radius > self.height:
+            return True
+
+        if self.bitmap_resolution is not None:
+            bitmap = self.clearance_bitmap(radius)
+            row = min(int(y * self.bitmap_resolution), bitmap.shape[0] - 1)
+            col = min(int(x * self.bitmap_resolution), bitmap.shape[1] - 1)
+            state = bitmap[row, col]
+            if state != BORDER:
+                return state == BLOCKED
+
+        if idx is None:
+            idx = self.candidates(x - radius, x + radius, y - radius, y + radius)
+        if len(idx) == 0:
+            return False
+
+        ox = self.x[idx]
+        oy = self.y[idx]
+        ow = self.half_width[idx]
+        oh = self.half_height[idx]
+
+        dx = x - np.maximum(ox - ow, np.minimum(x, ox + ow))
+        dy = y - np.maximum(oy - oh, np.minimum(y, oy + oh))
+
+        return bool((np.sqrt(dx * dx + dy * dy) < radius).any())
+
+    def within(self, x, y, reach):
+        """Function that returns the obstacles whose rectangle lies closer than reach to a point
+
+        Args:
+            x (float): x coordinate of the point
+            y (float): y coordinate of the point
+            reach (float): largest distance
+
+        Returns:
+            array: indices of the obstacles
+        """
+        idx = self.candidates(x - reach, x + reach, y - reach, y + reach)
+        if len(idx) == 0:
+            return idx
+
+        dx = np.maximum(np.abs(x - self.x[idx]) - self.half_width[idx], 0)
+        dy = np.maximum(np.abs(y - self.y[idx]) - self.half_height[idx], 0)
+        return idx[np.sqrt(dx * dx + dy * dy) < reach]
+
+    def clearance(self, x, y, reach, idx=None):
+        """Function that computes the distance from a point to the border and the nearest obstacle
+
+        Args:
+            x (float): x coordinate of the point
+            y (float): y coordinate of the point
+            reach (float): distances beyond this value are not searched
+            idx (array, optional): the obstacles that can lie within reach, such as a Verlet list. Defaults to None, search the spatial hash.
+
+        Returns:
+            float: the distance, at most reach
+        """
+        distance = min(x, self.width - x, y, self.height - y, reach)
+        if idx is None:
+            idx = self.candidates(x - reach, x + reach, y - reach, y + reach)
+        if len(idx) == 0:
+            return distance
+
+        dx = x - np.maximum(self.x[idx] - self.half_width[idx], np.minimum(x, self.x[idx] + self.half_width[idx]))
+        dy = y - np.maximum(self.y[idx] - self.half_height[idx], np.minimum(y, self.y[idx] + self.half_height[idx]))
+        return min(distance, np.sqrt(dx * dx + dy * dy).min().item())
+
+    def lookup(self, px, py, radius):
+        """Function that looks up points in the clearance bitmap of a radius
+
+        Args:
+            px (array): x coordinates of the points, inside the grid
+            py (array): y coordinates of the points, inside the grid
+            radius (float): sensing range of the agent
+
+        Returns:
+            array: FREE, BLOCKED or BORDER for every point
+        """
+        bitmap = self.clearance_bitmap(radius)
+        rows = np.minimum((py * self.bitmap_resolution).astype(int), bitmap.shape[0] - 1)
+        cols = np.minimum((px * self.bitmap_resolution).astype(int), bitmap.shape[1] - 1)
+        return bitmap[rows, cols]
+
+    def distance_raster(self, resolution, reach=np.inf):
+        """Function that computes the distance from the center of every pixel to the nearest obstacle
+
+        Args:
+            resolution (int): pixels per unit of length
+            reach (float, optional): distances beyond this value are left at infinity. Defaults to np.inf.
+
+        Returns:
+            array: distances of shape (rows, columns), zero inside an obstacle
+        """
+        pixel = 1 / resolution
+        columns = math.ceil(self.width * resolution)
+        rows = math.ceil(self.height * resolution)
+        centers_x = (np.arange(columns) + 0.5) * pixel
+        centers_y = (np.arange(rows) + 0.5) * pixel
+        distance = np.full((rows, columns), np.inf)
+        reach = min(reach, self.width + self.height)
+
+        for i in range(self.count):
+            ox, oy, ow, oh = self.x[i], self.y[i], self.half_width[i], self.half_height[i]
+
+            # Only the pixels within reach of the rectangle can get a finite distance
+            c0 = max(0, math.floor((ox - ow - reach) * resolution))
+            c1 = min(columns, math.ceil((ox + ow + reach) * resolution) + 1)
+            r0 = max(0, math.floor((oy - oh - reach) * resolution))
+            r1 = min(rows, math.ceil((oy + oh + reach) * resolution) + 1)
+            if c0 >= c1 or r0 >= r1:
+                continue
+
+            dx = np.maximum(np.abs(centers_x[c0:c1] - ox) - ow, 0)
+            dy = np.maximum(np.abs(centers_y[r0:r1] - oy) - oh, 0)
+            window = distance[r0:r1, c0:c1]
+            np.minimum(window, np.sqrt(dy[:, None] ** 2 + dx[None, :] ** 2), out=window)
+
+        return distance
+
+    def distance_field(self):
+        """Function that returns the signed distance field of the obstacles and the border, building it on first use.
+        The field is the distance to the nearest obstacle or border, and minus the depth inside an obstacle.
+
+        Returns:
+            array: signed distances of shape (rows, columns)
+            array: x component of the gradient of the field
+            array: y component of the gradient of the field
+        """
+        if self.field is None:
+            resolution = self.field_resolution
+            field = self.distance_raster(resolution)
+            centers_x = (np.arange(field.shape[1]) + 0.5) / resolution
+            centers_y = (np.arange(field.shape[0]) + 0.5) / resolution
+
+            # The border blocks a circle the same way an obstacle does
+            border = np.minimum(np.minimum(centers_y, self.height - centers_y)[:, None],
+                                np.minimum(centers_x, self.width - centers_x)[None, :])
+            field = np.minimum(field, border)
+
+            # Inside an obstacle the field is minus the distance to its edge
+            for i in range(self.count):
+                ox, oy, ow, oh = self.x[i], self.y[i], self.half_width[i], self.half_height[i]
+                c0 = max(0, math.floor((ox - ow) * resolution))
+                c1 = min(field.shape[1], math.ceil((ox + ow) * resolution))
+                r0 = max(0, math.floor((oy - oh) * resolution))
+                r1 = min(field.shape[0], math.ceil((oy + oh) * resolution))
+                if c0 >= c1 or r0 >= r1:
+                    continue
+                depth = np.minimum((oh - np.abs(centers_y[r0:r1] - oy))[:, None], (ow - np.abs(centers_x[c0:c1] - ox))[None, :])
+                window = field[r0:r1, c0:c1]
+                np.minimum(window, -depth, out=window, where=depth > 0)
+
+            gradient_y, gradient_x = np.gradient(field, 1 / resolution)
+            self.field = (field, gradient_x, gradient_y)
+        return self.field
+
+    def clearance_bitmap(self, radius):
+        """Function that returns the clearance bitmap of a radius, building it on first use.
+        The bitmap is the obstacle raster grown by the radius. A pixel is FREE if no circle centered in it collides, 
+        BLOCKED if every circle centered in it collides, and BORDER otherwise.
+
+        Args:
+            radius (float): sensing range of the agent
+
+        Returns:
+            array: FREE, BLOCKED or BORDER for every pixel, shape (rows, columns)
+        """
+        bitmap = self.bitmaps.get(radius)
+        if bitmap is None:
+            # The distance to the obstacles changes at most half a pixel diagonal within a pixel
+            half_diagonal = math.sqrt(2) / (2 * self.bitmap_resolution)
+            margin = half_diagonal + 1e-9
+            distance = self.distance_raster(self.bitmap_resolution, reach=radius + 2 * margin)
+
+            bitmap = np.full(distance.shape, BORDER, dtype=np.int8)
+            bitmap[distance - margin >= radius] = FREE
+            bitmap[distance + margin < radius] = BLOCKED
+            self.bitmaps[radius] = bitmap
+        return bitmap
+
+    def overlaps(self, x, y, half_width, half_height):
+        """Check if a rectangle at (x,y) with given width/height overlaps with any obstacle
+
+        Args:
+            x (float): x coordinate of the rectangle
+            y (float): y coordinate of the rectangle
+            half_width (float): half of the width of the rectangle
+            half_height (float): half of the heigth of the rectangle
+
+        Returns:
+            Bool: True if it overlaps with any obstacle, else False
+        """
+        idx = self.candidates(x - half_width, x + half_width, y - half_height, y + half_height)
+        if len(idx) == 0:
+            return False
+
+        dx = np.abs(x - self.x[idx])
+        dy = np.abs(y - self.y[idx])
+
+        return bool(((dx < half_width + self.half_width[idx]) & (dy < half_height + self.half_height[idx])).any())
+
+class NeighborGrid:
+    def __init__(self, xs, ys, cell_size):
+        """Initialization of the NeighborGrid class, a cell list of moving points such as agents.
+        Every square cell maps to the indices of the points inside it, and the cell of a point is only
+        updated when it crosses into another cell, so a proximity check only looks at the points in nearby cells.
+
+        Args:
+            xs (array): x coordinates of the points
+            ys (array): y coordinates of the points
+            cell_size (float): width and height of a cell
+        """
+        self.cell_size = cell_size
+        self.cells = {}
+        self.keys = np.empty((len(xs), 2), dtype=int)
+        self.order = None
+        for index, (x, y) in enumerate(zip(xs, ys)):
+            key = self.key(x, y)
+            self.keys[index] = key
+            self.cells.setdefault(key, []).append(index)
+
+    def key(self, x, y):
+        """Function that computes the cell of a point
+
+        Args:
+            x (float): x coordinate of the point
+            y (float): y coordinate of the point
+
+        Returns:
+            tuple: column and row of the cell
+        """
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def update(self, index, x, y):
+        """Function that moves a point to the cell of its new position
+
+        Args:
+            index (int): index of the point
+            x (float): new x coordinate of the point
+            y (float): new y coordinate of the point
+        """
+        key = self.key(x, y)
+        old = (self.keys.item(index, 0), self.keys.item(index, 1))
+        if key == old:
+            return
+        cell = self.cells[old]
+        cell.remove(index)
+        if not cell:
+            del self.cells[old]
+        self.cells.setdefault(key, []).append(index)
+        self.keys[index] = key
+        self.order = None
+
+    def near(self, x_min, x_max, y_min, y_max):
+        """Function that returns the points in the cells covered by a box
+
+        Args:
+            x_min (float): left side of the box
+            x_max (float): right side of the box
+            y_min (float): bottom side of the box
+            y_max (float): top side of the box
+
+        Returns:
+            array: indices of the points that may lie in the box
+        """
+        cx_min, cy_min = self.key(x_min, y_min)
+        cx_max, cy_max = self.key(x_max, y_max)
+        if len(self.keys) <= DENSE_LIMIT or (cx_max - cx_min + 1) * (cy_max - cy_min + 1) >= len(self.cells):
+            return np.arange(len(self.keys))
+
+        found = []
+        for cx in range(cx_min, cx_max + 1):
+            for cy in range(cy_min, cy_max + 1):
+                cell = self.cells.get((cx, cy))
+                if cell:
+                    found.extend(cell)
+        return np.array(found, dtype=int)
+
+    def pairs(self, px, py, reach):
+        """Function that lists all (query point, point) pairs that lie within reach along both axes in cell terms
+
+        Args:
+            px (array): x coordinates of the query points
+            py (array): y coordinates of the query points
+            reach (float): largest distance at which a pair matters
+
+        Returns:
+            array: indices of the query points
+            array: indices of the points
+        """
+        if self.order is None:
+            codes = cell_codes(self.keys[:, 0], self.keys[:, 1])
+            self.order = np.argsort(codes, kind='stable')
+            self.sorted_codes = codes[self.order]
+        return cell_pairs(self.sorted_codes, self.order, px, py, reach, self.cell_size)
+
+def cell_codes(cx, cy):
+    """Function that packs cell columns and rows into one sortable integer
+
+    Args:
+        cx (array): cell columns
+        cy (array): cell rows
+
+    Returns:
+        array: one integer per cell
+    """
+    return (np.asarray(cx, dtype=np.int64) << 32) + np.asarray(cy, dtype=np.int64)
+
+def cell_pairs(sorted_codes, order, px, py, reach, cell_size):
+    """Function that lists the pairs of query points and points in the cells within reach of the query point.
+    The points are given as their cell codes in sorted order, so the points of a cell are found with a binary search.
+
+    Args:
+        sorted_codes (array): sorted cell codes of the points
+        order (array): indices of the points in sorted order
+        px (array): x coordinates of the query points
+        py (array): y coordinates of the query points
+        reach (float): largest distance at which a pair matters
+        cell_size (float): width and height of a cell
+
+    Returns:
+        array: indices of the query points
+        array: indices of the points
+    """
+    if len(order) <= DENSE_LIMIT:
+        return np.repeat(np.arange(len(px)), len(order)), np.tile(order, len(px))
+
+    span = max(1, math.ceil(reach / cell_size))
+    qx = np.floor(np.asarray(px) / cell_size).astype(np.int64)
+    qy = np.floor(np.asarray(py) / cell_size).astype(np.int64)
+    offsets = np.arange(-span, span + 1)
+
+    # Every cell around every query point, shape (points, cells)
+    codes = cell_codes(qx[:, None] + np.repeat(offsets, len(offsets)), qy[:, None] + np.tile(offsets, len(offsets)))
+    start = np.searchsorted(sorted_codes, codes, side='left').ravel()
+    count = np.searchsorted(sorted_codes, codes, side='right').ravel() - start
+
+    query = np.repeat(np.repeat(np.arange(len(qx)), codes.shape[1]), count)
+    first = np.repeat(start - np.cumsum(count) + count, count)
+    return query, order[first + np.arange(count.sum())]
+
+def is_collision(grid, x, y, radius, agent=None):
+    """Check if a point (x,y) with given radius collides with any obstacle
+
+    Args:
+        grid (Grid): instance of Grid
+        x (float): x coordinate of the agent
+        y (float): y coordinate of the agent
+        radius (int): sensing range of the agent
+        agent (Agent, optional): the agent that is moving, its Verlet list is used near the agent. Defaults to None.
+
+    Returns:
+        Bool: True if there is a collision, false otherwise
+    """
+    return grid.obstacle_set.collides(x, y, radius, verlet_list(agent, grid, x, y))
+
+def is_collision_move(agent, grid, x, y, agents=True):
+    """Check if an agent moving to (x,y) collides with the border, an obstacle or, if agents is set, another agent.
+    After a full check the exact clearance of the point is recorded. For the next grid.clearance_steps steps
+    the checks are skipped while the new point stays within that clearance, less the distance the other agents may have come closer.
+
+    Args:
+        agent (Agent): the agent that is moving
+        grid (Grid): instance of Grid
+        x (float): x coordinate of the new position
+        y (float): y coordinate of the new position
+        agents (bool, optional): also check the other agents. Defaults to True.
+
+    Returns:
+        Bool: True if there is a collision, false otherwise
+    """
+    agent_array = grid.agent_array
+    if agent_array.clearance_steps is None or getattr(agent, 'array', None) is not agent_array:
+        return is_collision(grid, x, y, agent.radius, agent) or (agents and is_collision_agents(agent, grid, x, y, agent.radius))
+
+    i = agent.index
+    obstacle_set = grid.obstacle_set
+    if (agent_array.clear_version.item(i) == obstacle_set.version and
+            agent_array.steps - agent_array.clear_step.item(i) < agent_array.clearance_steps):
+        shift = math.hypot(x - agent_array.clear_x.item(i), y - agent_array.clear_y.item(i))
+        if agent_array.clear_static.item(i) - shift >= 0 and (not agents or
+                agent_array.clear_agents.item(i) - shift - (agent_array.sweep + agent_array.step_reach - agent_array.clear_sweep.item(i)) >= 0):
+            return False
+
+    # Full check, the clearance is the free distance beyond the radius.
+    # The Verlet list holds every obstacle within radius plus skin of its anchor, so it covers the reach less the distance from the anchor
+    radius = agent.radius
+    reach = radius + obstacle_set.cell_size
+    idx = verlet_list(agent, grid, x, y)
+    if idx is not None:
+        reach = min(reach, radius + agent_array.skin - math.hypot(x - agent_array.verlet_x.item(i), y - agent_array.verlet_y.item(i)))
+    static = obstacle_set.clearance(x, y, reach, idx) - radius
+    if static < 0:
+        return True
+    if agents:
+        others = agent_clearance(agent, grid, x, y, radius + obstacle_set.cell_size) - radius
+        if others < 0:
+            return True
+    else:
+        others = -np.inf
+
+    agent_array.clear_x[i] = x
+    agent_array.clear_y[i] = y
+    agent_array.clear_static[i] = static
+    agent_array.clear_agents[i] = others
+    agent_array.clear_sweep[i] = agent_array.sweep
+    agent_array.clear_step[i] = agent_array.steps
+    agent_array.clear_version[i] = obstacle_set.version
+    return False
+
+def agent_clearance(agent_self, grid, x, y, reach):
+    """Function that computes the distance from a point to the nearest agent other than agent_self
+
+    Args:
+        agent_self (Agent): the agent that is moving, it is skipped
+        grid (Grid): instance of Grid
+        x (float): x coordinate of the point
+        y (float): y coordinate of the point
+        reach (float): distances beyond this value are not searched
+
+    Returns:
+        float: the distance, at most reach
+    """
+    agent_array = grid.agent_array
+    search = reach + agent_array.half_size.max(initial=0)
+    others = agent_array.neighbors.near(x - search, x + search, y - search, y + search)
+    others = others[others != agent_self.index]
+    if len(others) == 0:
+        return reach
+
+    ax = agent_array.x[others]
+    ay = agent_array.y[others]
+    ah = agent_array.half_size[others]
+    dx = x - np.maximum(ax - ah, np.minimum(x, ax + ah))
+    dy = y - np.maximum(ay - ah, np.minimum(y, ay + ah))
+    return min(reach, np.sqrt(dx * dx + dy * dy).min().item())
+
+def verlet_list(agent, grid, px, py):
+    """Function that returns the Verlet list of an agent, the obstacles within radius plus skin of the position where
+    the list was built. The list is rebuilt when the agent has moved more than half the skin or an obstacle was added.
+    Any point closer than the skin to that position can only hit obstacles in the list.
+
+    Args:
+        agent (Agent, Particle): the agent that is moving, only Agents of grid.agent_array have a list
+        grid (Grid): instance of Grid
+        px (float, array): x coordinates of the points that are tested
+        py (float, array): y coordinates of the points that are tested
+
+    Returns:
+        array: indices of the obstacles, None if a point lies outside the skin or the agent has no list
+    """
+    agent_array = grid.agent_array
+    if getattr(agent, 'array', None) is not agent_array or agent_array.skin is None:
+        return None
+
+    i = agent.index
+    skin = agent_array.skin
+    x = agent_array.x.item(i)
+    y = agent_array.y.item(i)
+    anchor_x = agent_array.verlet_x.item(i)
+    anchor_y = agent_array.verlet_y.item(i)
+    obstacle_set = grid.obstacle_set
+    if agent_array.verlet_version.item(i) != obstacle_set.version or (x - anchor_x) ** 2 + (y - anchor_y) ** 2 > skin * skin / 4:
+        agent_array.verlet[i] = obstacle_set.within(x, y, agent_array.radius.item(i) + skin)
+        anchor_x = agent_array.verlet_x[i] = x
+        anchor_y = agent_array.verlet_y[i] = y
+        agent_array.verlet_version[i] = obstacle_set.version
+
+    # Safety guard: points beyond the skin may hit obstacles outside the list
+    if np.ndim(px) == 0:
+        outside = (px - anchor_x) ** 2 + (py - anchor_y) ** 2 > skin * skin
+    else:
+        outside = ((px - anchor_x) ** 2 + (py - anchor_y) ** 2).max() > skin * skin
+    if outside:
+        return None
+    return agent_array.verlet[i]
+
+def query_agents(agent_self, grid, px, py, radius):
+    """Check for many points (x,y) with given radius if they collide with any agent other than agent_self
+
+    Args:
+        agent_self (Agent, Particle): the agent or particle that is moving, it is skipped
+        grid (Grid): instance of a grid
+        px (array): x coordinates of the points
+        py (array): y coordinates of the points
+        radius (float): sensing range of the agent
+
+    Returns:
+        array: boolean array, True if the point collides with an agent
+    """
+    agent_array = grid.agent_array
+    reach = radius + agent_array.half_size.max(initial=0)
+    query, other = agent_array.neighbors.pairs(px, py, reach)
+    if getattr(agent_self, 'array', None) is agent_array:
+        keep = other != agent_self.index
+        query = query[keep]
+        other = other[keep]
+
+    # Closest point on every nearby agent to the circle center, one entry per pair
+    ah = agent_array.half_size[other]
+    dx = px[query] - np.maximum(agent_array.x[other] - ah, np.minimum(px[query], agent_array.x[other] + ah))
+    dy = py[query] - np.maximum(agent_array.y[other] - ah, np.minimum(py[query], agent_array.y[other] + ah))
+
+    hit = np.zeros(len(px), dtype=bool)
+    hit[query[np.sqrt(dx * dx + dy * dy) < radius]] = True
+    return hit
+
+def is_collision_agents(agent_self, grid, x, y, radius):
+    """Check if a point (x,y) with given radius collides with any agent
+
+    Args:
+        agent_self (Agent): instacne of class Agent
+        grid (Grid): instance of a grid
+        x (float): x coordinate of the agent
+        y (float): y coordinate of the agent
+        radius (int): sensing range of the agent
+
+    Returns:
+        Bool: True if there is a collision, false otherwise
+    """
+    # Check bounds
+    if x - radius < 0 or x + radius > grid.width or y - radius < 0 or y + radius > grid.height:
+        return True
+
+    agent_array = grid.agent_array
+    reach = radius + agent_array.half_size.max(initial=0)
+    others = agent_array.neighbors.near(x - reach, x + reach, y - reach, y + reach)
+    if getattr(agent_self, 'array', None) is agent_array:
+        others = others[others != agent_self.index]
+
+    ax = agent_array.x[others]
+    ay = agent_array.y[others]
+    ah = agent_array.half_size[others]
+    dx = x - np.maximum(ax - ah, np.minimum(x, ax + ah))
+    dy = y - np.maximum(ay - ah, np.minimum(y, ay + ah))
+
+    return bool((np.sqrt(dx * dx + dy * dy) < radius).any())
+
+def move_agents(grid, dx, dy):
+    """Move all agents by (dx,dy) at the same time, every agent whose move causes a collision stays in place.
+    The moves are first tested against the obstacles and the current position of the other agents.
+    An agent that would then end up in collision with another agent's new position stays in place as well.
+
+    Args:
+        grid (Grid): instance of the grid
+        dx (array): proposed x steps of the agents
+        dy (array): proposed y steps of the agents
+
+    Returns:
+        array: boolean array of the agents that moved
+    """
+    agent_array = grid.agent_array
+    new_x = agent_array.x + dx
+    new_y = agent_array.y + dy
+
+    blocked = np.zeros(agent_array.count, dtype=bool)
+    for radius in np.unique(agent_array.radius):
+        same = agent_array.radius == radius
+        blocked[same] = grid.obstacle_set.query(np.column_stack((new_x[same], new_y[same])), radius)
+
+    blocked |= agents_hit(agent_array, new_x, new_y, agent_array.x, agent_array.y)
+
+    # Moves that end up in collision with another agent's new position are taken back
+    final_x = np.where(blocked, agent_array.x, new_x)
+    final_y = np.where(blocked, agent_array.y, new_y)
+    moved = ~blocked & ~agents_hit(agent_array, final_x, final_y, final_x, final_y)
+
+    agent_array.setcoords(new_x, new_y, moved)
+    return moved
+
+def agents_hit(agent_array, px, py, ax, ay):
+    """Check for every agent if a circle at its point collides with the box of any other agent
+
+    Args:
+        agent_array (AgentArray): the agents
+        px (array): x coordinates of the circle of every agent
+        py (array): y coordinates of the circle of every agent
+        ax (array): x coordinates of the box of every agent
+        ay (array): y coordinates of the box of every agent
+
+    Returns:
+        array: boolean array, True if the circle of the agent collides with another agent
+    """
+    cell_size = agent_array.neighbors.cell_size
+    codes = cell_codes(np.floor(ax / cell_size), np.floor(ay / cell_size))
+    order = np.argsort(codes, kind='stable')
+    reach = agent_array.radius.max(initial=0) + agent_array.half_size.max(initial=0)
+    query, other = cell_pairs(codes[order], order, px, py, reach, cell_size)
+    keep = query != other
+    query = query[keep]
+    other = other[keep]
+
+    ah = agent_array.half_size[other]
+    dx = px[query] - np.maximum(ax[other] - ah, np.minimum(px[query], ax[other] + ah))
+    dy = py[query] - np.maximum(ay[other] - ah, np.minimum(py[query], ay[other] + ah))
+
+    hit = np.zeros(agent_array.count, dtype=bool)
+    hit[query[np.sqrt(dx * dx + dy * dy) < agent_array.radius[query]]] = True
+    return hit
+
+def avoidObstacle(r, v_x, v_y, V_LIMIT, grid):
+    """Function that computes how to avoid the obstacle.
+    All the candidate moves are built from the rotation table and tested in one batch, 
+    the first free candidate in the order of ANGLE_LIST and MAGNITUDE_LIST is returned.
+
+    Args:
+        r (Agent): instance of Agent
+        v_x (float): x velocity
+        v_y (float): y velocity
+        V_LIMIT (float): maximum velocity
+        grid (Grid): instance of a grid
+
+    Returns:
+        float: New computed values to avoid obstacles
+    """
+    heading = math.atan2(v_y, v_x)
+    cos_h = math.cos(heading)
+    sin_h = math.sin(heading)
+
+    # Rotate the heading by every offset and scale it by every magnitude
+    ndx = (cos_h * ROTATION_COS - sin_h * ROTATION_SIN) * MAGNITUDES * V_LIMIT
+    ndy = (sin_h * ROTATION_COS + cos_h * ROTATION_SIN) * MAGNITUDES * V_LIMIT
+    new_x = r.x + ndx
+    new_y = r.y + ndy
+
+    blocked = grid.obstacle_set.query(np.column_stack((new_x, new_y)), r.radius, verlet_list(r, grid, new_x, new_y))
+    free = np.flatnonzero(~blocked)
+    if len(free) > 0:
+        # Only the candidates that miss the obstacles are tested against the agents
+        free = free[~query_agents(r, grid, new_x[free], new_y[free], r.radius)]
+    if len(free) == 0:
+        return r.x, r.y, 0.0, 0.0
+
+    i = free[0]
+    return float(new_x[i]), float(new_y[i]), float(ndx[i]), float(ndy[i])
+
+def slideAlongObstacle(r, v_x, v_y, V_LIMIT, grid):
+    """Function that avoids the obstacle by sliding along its boundary.
+    The gradient of the signed distance field at the blocked position is the normal of the obstacle or border in the way,
+    the part of the velocity that points into it is removed and the rest is scaled back to the same speed.
+    The slide is tested once, if it is blocked as well the agent stays in place.
+    A move that is only blocked by other agents has no obstacle to slide along and falls back to avoidObstacle.
+
+    Args:
+        r (Agent): instance of Agent
+        v_x (float): x velocity
+        v_y (float): y velocity
+        V_LIMIT (float): maximum velocity
+        grid (Grid): instance of a grid
+
+    Returns:
+        float: New computed values to avoid obstacles
+    """
+    speed = min(math.hypot(v_x, v_y), V_LIMIT)
+    if speed == 0:
+        return r.x, r.y, 0.0, 0.0
+
+    obstacle_set = grid.obstacle_set
+    blocked_x = r.x + v_x
+    blocked_y = r.y + v_y
+    if not obstacle_set.collides(blocked_x, blocked_y, r.radius, verlet_list(r, grid, blocked_x, blocked_y)):
+        return avoidObstacle(r, v_x, v_y, V_LIMIT, grid)
+
+    field, gradient_x, gradient_y = obstacle_set.distance_field()
+    row = min(max(int(blocked_y * obstacle_set.field_resolution), 0), field.shape[0] - 1)
+    col = min(max(int(blocked_x * obstacle_set.field_resolution), 0), field.shape[1] - 1)
+    n_x = gradient_x[row, col]
+    n_y = gradient_y[row, col]
+    n_len = math.hypot(n_x, n_y)
+    if n_len == 0:
+        return r.x, r.y, 0.0, 0.0
+    n_x /= n_len
+    n_y /= n_len
+
+    # Remove the component of the velocity that points into the obstacle
+    into = min(v_x * n_x + v_y * n_y, 0)
+    t_x = v_x - into * n_x
+    t_y = v_y - into * n_y
+    t_len = math.hypot(t_x, t_y)
+    if t_len < 1e-9:
+        # Head-on, slide to the left of the normal
+        t_x, t_y, t_len = -n_y, n_x, 1.0
+
+    ndx = t_x / t_len * speed
+    ndy = t_y / t_len * speed
+    new_x = r.x + ndx
+    new_y = r.y + ndy
+    if is_collision(grid, new_x, new_y, r.radius, r) or is_collision_agents(r, grid, new_x, new_y, r.radius):
+        return r.x, r.y, 0.0, 0.0
+    return new_x, new_y, ndx, ndy
+
+# Obstacle avoidance strategies that the PSO variants can select
+AVOIDANCE = {'probe': avoidObstacle, 'field': slideAlongObstacle}
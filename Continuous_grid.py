@@ -5,9 +5,11 @@ import numpy as np
 from matplotlib.colors import ListedColormap
 from matplotlib.patches import Patch
 import math
+from Fitness import FitnessField, FitnessTree
+from Collision import ObstacleSet, NeighborGrid, cell_codes, cell_pairs, DENSE_LIMIT
 
 class Grid:
-    def __init__(self, side, obstacles, targets, number_agents, agent_half_size, agent_radius, obstacle_half_size, target_half_size, seed):
+    def __init__(self, side, obstacles, targets, number_agents, agent_half_size, agent_radius, obstacle_half_size, target_half_size, seed, cell_size=10, bitmap_resolution=None, field_resolution=2, verlet_skin=10, clearance_steps=10, fitness='exact', fitness_resolution=1, fitness_tolerance=0.5):
         """Initialization function of the Grid class
 
         Args:
@@ -20,6 +22,15 @@ class Grid:
             obstacle_half_size (list): A range of the possible values of the size and heigth
             target_half_size (_type_): half of the size of the target. If it is one, the target is 2×2.
             seed (int): Used for reprodcutive purposes
+            cell_size (float, optional): size of the buckets of the spatial hash over the obstacles. Defaults to 10.
+            bitmap_resolution (int, optional): pixels per unit of the clearance bitmaps for the collision tests, None for exact tests only. Defaults to None.
+            field_resolution (int, optional): pixels per unit of the signed distance field used by the 'field' avoidance. Defaults to 2.
+            verlet_skin (float, optional): margin of the per-agent lists of nearby obstacles, None to always search the spatial hash. Defaults to 10.
+            clearance_steps (int, optional): number of steps an agent may skip collision checks while it stays within its recorded clearance, None to always check. Defaults to 10.
+            fitness (str, optional): how the PSO algorithms compute the fitness, 'exact' sums over all targets, 'field' looks it up in a precomputed raster,
+                'tree' approximates distant groups of targets with a quadtree. Defaults to 'exact'.
+            fitness_resolution (int, optional): raster corners per unit of length of the 'field' fitness. Defaults to 1.
+            fitness_tolerance (float, optional): largest ratio of node size to distance at which the 'tree' fitness aggregates a node. Defaults to 0.5.
         """
         #Checks if a seed has been given
         self.seed = seed
@@ -33,12 +44,17 @@ class Grid:
         self.number_agents = number_agents #Setter in function
         self.agent_half_size = agent_half_size
         self.agent_radius = agent_radius
+        self.verlet_skin = verlet_skin
+        self.clearance_steps = clearance_steps
         self.agents= []
         self.grid = self.make_grid()
         self.safe_space = [[5, int(side/2), 5]]
         self.set_grid(self.safe_space[0][0], self.safe_space[0][1], self.safe_space[0][2], self.safe_space[0][2], 4)
         self.initialize_agents()
 
+        # Contiguous copy of the obstacles with a spatial hash for the collision queries
+        self.obstacle_set = ObstacleSet(self.width, self.height, cell_size=cell_size, bitmap_resolution=bitmap_resolution, field_resolution=field_resolution)
+
         #Check if you need to randomize the obstacles 
         if type(obstacles) == int:
 
@@ -65,6 +81,19 @@ class Grid:
             self.targets = targets
             self.set_targets()  
 
+        # Targets that have not been found yet, self.targets keeps the full list
+        self.target_store = TargetStore(self.targets)
+
+        if fitness == 'exact':
+            self.fitness_model = None
+        elif fitness == 'field':
+            self.fitness_model = FitnessField(self.width, self.height, *self.target_store.positions(), resolution=fitness_resolution)
+        elif fitness == 'tree':
+            self.fitness_model = FitnessTree(self.width, self.height, *self.target_store.positions(), tolerance=fitness_tolerance)
+        else:
+            raise ValueError(f"Unknown fitness mode: {fitness}")
+        self.agent_array.fitness_model = self.fitness_model
+
     # create a integer matrix representation of the grid (self.height x self.width)
     def make_grid(self):
         """Function that creates the Grid
@@ -106,14 +135,11 @@ class Grid:
                 y = random.uniform(half_height, self.height - half_height)
                 
                 # Check if this position overlaps with existing obstacles
-                if (not self.check_overlap(x, y, half_width, half_height, self.obstacles) and 
+                if (not self.obstacle_set.overlaps(x, y, half_width, half_height) and 
                     not self.check_overlap(x, y, half_width, half_height, self.agents) and
                     not self.check_overlap(x, y, half_width, half_height, self.safe_space)):
 
-                    self.obstacles.append([x, y, half_width, half_height])
-                    
-                    # Update visualization grid
-                    self.set_grid(x, y, half_width, half_height, 1)
+                    self.add_obstacle(x, y, half_width, half_height)
                     placed = True
                     
                     # Add adjacent obstacles with some probability
@@ -124,6 +150,22 @@ class Grid:
         """
         for x, y, width, height in self.obstacles:
             self.set_grid(x, y, width, height, 1)        
+            self.obstacle_set.add(x, y, width, height)
+
+    def add_obstacle(self, x, y, half_width, half_height):
+        """Function that adds an obstacle to the obstacle list, the spatial hash and the grid
+
+        Args:
+            x (float): x coordinate of the obstacle
+            y (float): y coordinate of the obstacle
+            half_width (float): half of the width of the obstacle
+            half_height (float): half of the height of the obstacle
+        """
+        self.obstacles.append([x, y, half_width, half_height])
+        self.obstacle_set.add(x, y, half_width, half_height)
+
+        # Update visualization grid
+        self.set_grid(x, y, half_width, half_height, 1)
 
     def place_adjacent_obstacles(self, x, y, half_width_prev, half_height_prev):
         """Function that expands on obstacles to create varying shapes
@@ -160,13 +202,10 @@ class Grid:
                 if (half_width <= new_x <= self.width - half_width and 
                     half_height <= new_y <= self.height - half_height and 
                     not self.check_overlap(new_x, new_y, half_width, half_height, self.agents) and
-                    not self.check_overlap(new_x, new_y, half_width, half_height, self.obstacles) and
+                    not self.obstacle_set.overlaps(new_x, new_y, half_width, half_height) and
                     not self.check_overlap(new_x, new_y, half_width, half_height, self.safe_space)):
                     
-                    self.obstacles.append([new_x, new_y, half_width, half_height])
-                    
-                    # Update visualization grid
-                    self.set_grid(new_x, new_y, half_width, half_height, 1)
+                    self.add_obstacle(new_x, new_y, half_width, half_height)
                     placed = True
                     
                     # Recursive call to potentially place more adjacent obstacles
@@ -188,7 +227,7 @@ class Grid:
                 y = random.uniform(self.target_half_size, self.height - self.target_half_size)
                 
                 # Check if this position is clear of obstacles
-                if (not self.check_overlap(x, y, self.target_half_size, self.target_half_size, self.obstacles) and 
+                if (not self.obstacle_set.overlaps(x, y, self.target_half_size, self.target_half_size) and 
                     not self.check_overlap(x, y, self.target_half_size, self.target_half_size, self.agents) and 
                     not self.check_overlap(x, y, self.target_half_size, self.target_half_size, self.targets) and
                     not self.check_overlap(x, y, self.target_half_size, self.target_half_size, self.safe_space)):
@@ -203,21 +242,26 @@ class Grid:
     def initialize_agents(self): 
         """Function that initialies the agents within the grid.
         """
+        xs = []
+        ys = []
         for i in range(self.number_agents):
-            x = self.agent_radius + math.floor(i / 3) * self.agent_half_size * 3
-            y = self.height/2 + (i % 3 - 1) * self.agent_half_size * 3
-            agent = Agent(self.agent_radius, x, y, self.agent_half_size)
-            self.agents.append(agent)
+            xs.append(self.agent_radius + math.floor(i / 3) * self.agent_half_size * 3)
+            ys.append(self.height/2 + (i % 3 - 1) * self.agent_half_size * 3)
 
-            #After determining the position, set the agents in the grid
-            self.set_grid(x, y, agent.half_size, agent.half_size, 2)
+        self.agent_array = AgentArray(self.agent_radius, xs, ys, self.agent_half_size, skin=self.verlet_skin, clearance_steps=self.clearance_steps)
+        self.agents = self.agent_array.agents
+
+        #After determining the position, set the agents in the grid
+        for x, y in zip(xs, ys):
+            self.set_grid(x, y, self.agent_half_size, self.agent_half_size, 2)
 
     def pos_change(self):
-        """Function that allows for changing the position of the agents
+        """Function that allows for changing the position of the agents, called once at the end of every step
         """
         for agent in self.agents:
             self.set_grid(agent.last_x, agent.last_y, agent.half_size, agent.half_size, 0)
             self.set_grid(agent.x, agent.y, agent.half_size, agent.half_size, 2)
+        self.agent_array.end_step()
 
 
     def check_overlap(self, x, y, half_width, half_height, objects):
@@ -270,6 +314,54 @@ class Grid:
         """
         self.set_grid(x, y, half_size, half_size, 0)
 
+    def detect_targets(self, margin=0):
+        """Function that detects the targets within range of the agents, all in one step.
+        The distances between all agents and all targets are computed at once, with many targets only 
+        the pairs in nearby cells are tested. A target within range of several agents counts for the first of them.
+
+        Args:
+            margin (float, optional): extra detection range on top of the agent radius and target size. Defaults to 0.
+
+        Returns:
+            list: indices in self.targets of the detected targets, they are removed from the target store
+        """
+        store = self.target_store
+        if store.count == 0:
+            return []
+        tx, ty, tr = store.x[:store.count], store.y[:store.count], store.half_size[:store.count]
+        agent_array = self.agent_array
+
+        if store.count <= DENSE_LIMIT:
+            distance = np.sqrt((agent_array.x[:, None] - tx) ** 2 + (agent_array.y[:, None] - ty) ** 2)
+            hit = distance < agent_array.radius[:, None] + tr + margin
+            detected = np.flatnonzero(hit.any(axis=0))
+            finder = hit[:, detected].argmax(axis=0)
+        else:
+            reach = agent_array.radius.max() + tr.max() + margin
+            codes = cell_codes(np.floor(tx / reach), np.floor(ty / reach))
+            order = np.argsort(codes, kind='stable')
+            agent, target = cell_pairs(codes[order], order, agent_array.x, agent_array.y, reach, reach)
+            distance = np.sqrt((agent_array.x[agent] - tx[target]) ** 2 + (agent_array.y[agent] - ty[target]) ** 2)
+            hit = distance < agent_array.radius[agent] + tr[target] + margin
+
+            # The first agent that is in range of every target
+            first = np.full(store.count, agent_array.count)
+            np.minimum.at(first, target[hit], agent[hit])
+            detected = np.flatnonzero(first < agent_array.count)
+            finder = first[detected]
+
+        found = []
+        # Highest slot first, so the swap-remove never moves a target that is still to be removed
+        for slot, a in zip(detected[::-1], finder[::-1]):
+            self.agents[a].targets_found += 1
+            target_x, target_y, target_radius = tx.item(slot), ty.item(slot), tr.item(slot)
+            self.remove_target(target_x, target_y, target_radius)
+            target_id = store.remove(slot)
+            if self.fitness_model is not None:
+                self.fitness_model.remove(target_id, target_x, target_y)
+            found.append(target_id)
+        return found[::-1]
+
     def total_distance_covered(self):
         """Function that computes the total distance that have been covered by all the agents in the grid combined
 
@@ -282,34 +374,199 @@ class Grid:
                 total_distance += math.dist([agent.list_x[i], agent.list_y[i]], [agent.list_x[i+1], agent.list_y[i+1]])
         return total_distance
 
-class Agent:
-    pbest = np.inf
-    pbest_p = np.inf
-    pbest_avg = np.inf
+class TargetStore:
+    def __init__(self, targets):
+        """Initialization of the TargetStore class.
+        The targets that have not been found are kept in the first count entries of contiguous arrays.
+        A found target is removed in O(1) by moving the last target into its entry.
+
+        Args:
+            targets (list): targets as [x, y, half_size]
+        """
+        n = len(targets)
+        self.count = n
+        self.x = np.array([t[0] for t in targets], dtype=float)
+        self.y = np.array([t[1] for t in targets], dtype=float)
+        self.half_size = np.array([t[2] for t in targets], dtype=float)
+        self.ids = np.arange(n)
+        self.removed = []
 
-    def __init__(self, radius, x, y, half_size):
-        """Initialization of the Agent class
+    def remove(self, slot):
+        """Function that removes the target in an entry, the last target takes its place
 
         Args:
-            radius (int): sensing range of the agent
-            x (float): x coordinate of the agent
-            y (float): y coordinate of the agent
-            half_size (int): half of th esize of the agent
+            slot (int): entry of the target
+
+        Returns:
+            int: index of the removed target in the list the store was made from
         """
-        self.radius = radius
-        self.x = x
-        self.y = y
-        self.Vx = np.random.uniform(-5, 5)
-        self.Vy = np.random.uniform(-5, 5)
-        self.last_x = x
-        self.last_y = y
-        self.px = x
-        self.py = y
-        self.pbest = float('inf')
-        self.list_y = [y]
-        self.list_x = [x]
-        self.half_size = half_size  # Agent's physical size
-        self.targets_found = 0
+        last = self.count - 1
+        target_id = self.ids.item(slot)
+        for array in (self.x, self.y, self.half_size, self.ids):
+            array[slot], array[last] = array[last], array[slot]
+        self.count = last
+        self.removed.append(target_id)
+        return target_id
+
+    def positions(self):
+        """Function that returns the coordinates of the targets that have not been found.
+        These are views on the arrays, they change when a target is removed.
+
+        Returns:
+            array: x coordinates of the targets
+            array: y coordinates of the targets
+        """
+        return self.x[:self.count], self.y[:self.count]
+
+class AgentArray:
+    def __init__(self, radius, xs, ys, half_size, cell_size=None, skin=None, clearance_steps=None):
+        """Initialization of the AgentArray class.
+        The state of all agents is kept in aligned arrays, entry i of every array belongs to agent i.
+        The agents list holds an Agent view per entry, for code that works on one agent at a time.
+        A NeighborGrid follows the positions, so proximity checks only look at the agents in nearby cells.
+
+        Args:
+            radius (int): sensing range of the agents
+            xs (list): x coordinates of the agents
+            ys (list): y coordinates of the agents
+            half_size (int): half of the size of the agents
+            cell_size (float, optional): cell size of the neighbor grid. Defaults to None, the reach of a collision check.
+            skin (float, optional): margin of the per-agent lists of nearby obstacles. Defaults to None, no lists.
+            clearance_steps (int, optional): number of steps a recorded clearance stays valid. Defaults to None, no clearance cache.
+        """
+        n = len(xs)
+        self.count = n
+        self.radius = np.full(n, radius, dtype=float)
+        self.half_size = np.full(n, half_size, dtype=float)
+        self.x = np.array(xs, dtype=float)
+        self.y = np.array(ys, dtype=float)
+
+        # Drawn as Vx, Vy per agent, in the same order as one agent at a time
+        velocity = np.random.uniform(-5, 5, size=(n, 2))
+        self.Vx = velocity[:, 0].copy()
+        self.Vy = velocity[:, 1].copy()
+
+        self.last_x = self.x.copy()
+        self.last_y = self.y.copy()
+        self.px = self.x.copy()
+        self.py = self.y.copy()
+        self.pbest = np.full(n, np.inf)
+        self.pbest_p = np.full(n, np.inf)
+        self.pbest_avg = np.full(n, np.inf)
+        self.targets_found = np.zeros(n, dtype=int)
+
+        # Fitness model the agents are scored with, None for the exact sum over the targets
+        self.fitness_model = None
+
+        if cell_size is None:
+            cell_size = radius + half_size
+        self.neighbors = NeighborGrid(self.x, self.y, cell_size)
+
+        # Verlet lists: the obstacles within radius plus skin of the position where the list was built
+        self.skin = skin
+        self.verlet = [None] * n
+        self.verlet_x = np.full(n, np.nan)
+        self.verlet_y = np.full(n, np.nan)
+        self.verlet_version = np.full(n, -1)
+
+        # Clearance cache: the free distance around a point to the border and obstacles, and to the other agents.
+        # sweep adds up the largest move of any agent in every step, it bounds how far another agent can have come closer
+        self.clearance_steps = clearance_steps
+        self.steps = 0
+        self.sweep = 0.0
+        self.step_reach = 0.0
+        self.clear_x = np.full(n, np.nan)
+        self.clear_y = np.full(n, np.nan)
+        self.clear_static = np.full(n, -np.inf)
+        self.clear_agents = np.full(n, -np.inf)
+        self.clear_sweep = np.zeros(n)
+        self.clear_step = np.zeros(n, dtype=int)
+        self.clear_version = np.full(n, -1)
+
+        self.agents = [Agent(self, i) for i in range(n)]
+
+    def setcoords(self, x, y, mask=None):
+        """Function that changes the position of all agents, or of the agents in the mask
+
+        Args:
+            x (array): new x coordinates of all agents
+            y (array): new y coordinates of all agents
+            mask (array, optional): boolean array of the agents that move. Defaults to None, all agents move.
+        """
+        if mask is None:
+            mask = np.ones(self.count, dtype=bool)
+        if mask.any():
+            self.step_reach = max(self.step_reach, np.hypot(x[mask] - self.x[mask], y[mask] - self.y[mask]).max())
+        self.last_x[mask] = self.x[mask]
+        self.last_y[mask] = self.y[mask]
+        self.x[mask] = x[mask]
+        self.y[mask] = y[mask]
+        for i in np.flatnonzero(mask):
+            self.agents[i].list_x.append(float(self.x[i]))
+            self.agents[i].list_y.append(float(self.y[i]))
+            self.neighbors.update(i, self.x[i], self.y[i])
+
+    def end_step(self):
+        """Function that closes a step, the largest move of the step is added to the sweep
+        """
+        self.sweep += self.step_reach
+        self.step_reach = 0.0
+        self.steps += 1
+
+    def setVelocity(self, vx, vy):
+        """Function that sets the velocity of all agents
+
+        Args:
+            vx (array): new x velocities
+            vy (array): new y velocities
+        """
+        self.Vx[:] = vx
+        self.Vy[:] = vy
+
+def array_field(name):
+    """Function that creates a property that reads and writes the entry of an Agent in an AgentArray array
+
+    Args:
+        name (str): name of the array in AgentArray
+
+    Returns:
+        property: property for the Agent class
+    """
+    def get(agent):
+        return getattr(agent.array, name).item(agent.index)
+
+    def set(agent, value):
+        getattr(agent.array, name)[agent.index] = value
+
+    return property(get, set)
+
+class Agent:
+    radius = array_field('radius')
+    half_size = array_field('half_size')  # Agent's physical size
+    x = array_field('x')
+    y = array_field('y')
+    Vx = array_field('Vx')
+    Vy = array_field('Vy')
+    last_x = array_field('last_x')
+    last_y = array_field('last_y')
+    px = array_field('px')
+    py = array_field('py')
+    pbest = array_field('pbest')
+    pbest_p = array_field('pbest_p')
+    pbest_avg = array_field('pbest_avg')
+    targets_found = array_field('targets_found')
+
+    def __init__(self, array, index):
+        """Initialization of the Agent class, a view on one entry of an AgentArray
+
+        Args:
+            array (AgentArray): the arrays that hold the state of the agent
+            index (int): index of the agent in the arrays
+        """
+        self.array = array
+        self.index = index
+        self.list_x = [float(array.x[index])]
+        self.list_y = [float(array.y[index])]
     
     def setcoords(self, x, y):
         """Function that changes the position of the agent
@@ -318,12 +575,15 @@ class Agent:
             x (float): new x coordinate
             y (float): new y coordinate
         """
+        array = self.array
+        array.step_reach = max(array.step_reach, math.hypot(x - self.x, y - self.y))
         self.last_x = self.x
         self.last_y = self.y
         self.x = x
         self.y = y
         self.list_x.append(x)
         self.list_y.append(y)
+        self.array.neighbors.update(self.index, x, y)
     
     def setVelocity(self, vx, vy):
         """Function that sets the velocity of the agent
@@ -335,10 +595,21 @@ class Agent:
         self.Vx = vx
         self.Vy = vy
 
-fig, ax = plt.subplots(figsize=(6, 6))
-plt.ion()  # Turn on interactive mode
+fig, ax = None, None
+
+def get_axes():
+    """Function that creates the figure on first use, so headless runs never start matplotlib
+
+    Returns:
+        Axes: the axes that visualize_grid draws on
+    """
+    global fig, ax
+    if ax is None:
+        fig, ax = plt.subplots(figsize=(6, 6))
+        plt.ion()  # Turn on interactive mode
+    return ax
 
-def visualize_grid(grid, t, trails=True, done=False, name=None):
+def visualize_grid(grid, t, trails=True, done=False, name=None, checkpoints=(10, 50, 100)):
     """function that allows for visualising the grid
 
     Args:
@@ -347,7 +618,9 @@ def visualize_grid(grid, t, trails=True, done=False, name=None):
         trails (bool): If you want to show that trail covered by each agent. Defaults to True.
         done (bool): If the stop criteria has been reached. Defaults to False.
         name (string, optional): name of the used algorithm. Defaults to None.
+        checkpoints (tuple, optional): timesteps at which the frame is saved. Defaults to (10, 50, 100).
     """
+    ax = get_axes()
     color_grid = grid.grid
     cmap = ListedColormap(["gray", "black", "red", "yellow", 'darkgray'])
     labels = ['Empty', 'Obstacle', 'Agent', 'Target', 'Safe space']
@@ -365,5 +638,58 @@ def visualize_grid(grid, t, trails=True, done=False, name=None):
     # Add legend once (optional: move outside if it causes clutter)
     ax.legend(handles=legend_elements, loc='upper right', fontsize='small')
 
-    if t in [10, 50, 100] or done == True:
-        plt.savefig(f'plots/{name}_agents-{grid.number_agents}_targets-{grid.nr_of_targets}_obstacles-{grid.nr_of_obstacles}_seed-{grid.seed}_step-{t}.png', bbox_inches='tight')
+    if t in checkpoints or done == True:
+        plt.savefig(f'plots/{name}_side-{grid.width}_agents-{grid.number_agents}_targets-{grid.nr_of_targets}_obstacles-{grid.nr_of_obstacles}_seed-{grid.seed}_step-{t}.png', bbox_inches='tight')
+
+class NullSink:
+    """Frame sink that drops every frame, meant for production sweeps
+    """
+    def emit(self, grid, t, done=False, name=None):
+        """Function that receives a frame from an algorithm
+
+        Args:
+            grid (Grid): instance of the grid
+            t (int): current timestep
+            done (bool): If the stop criteria has been reached. Defaults to False.
+            name (string, optional): name of the used algorithm. Defaults to None.
+        """
+        pass
+
+class CheckpointSink:
+    """Frame sink that only renders the frames that get saved
+    """
+    def __init__(self, checkpoints=(10, 50, 100), trails=True):
+        """Initialization of the CheckpointSink class
+
+        Args:
+            checkpoints (tuple, optional): timesteps at which a frame is saved. Defaults to (10, 50, 100).
+            trails (bool, optional): If you want to show that trail covered by each agent. Defaults to True.
+        """
+        self.checkpoints = checkpoints
+        self.trails = trails
+
+    def emit(self, grid, t, done=False, name=None):
+        """Function that renders and saves the frame if t is a checkpoint or the run is done
+
+        Args:
+            grid (Grid): instance of the grid
+            t (int): current timestep
+            done (bool): If the stop criteria has been reached. Defaults to False.
+            name (string, optional): name of the used algorithm. Defaults to None.
+        """
+        if t in self.checkpoints or done:
+            visualize_grid(grid, t, trails=self.trails, done=done, name=name, checkpoints=self.checkpoints)
+
+class InteractiveSink(CheckpointSink):
+    """Frame sink that renders every frame it receives, and saves the checkpoint frames
+    """
+    def emit(self, grid, t, done=False, name=None):
+        """Function that renders the frame, and saves it if t is a checkpoint or the run is done
+
+        Args:
+            grid (Grid): instance of the grid
+            t (int): current timestep
+            done (bool): If the stop criteria has been reached. Defaults to False.
+            name (string, optional): name of the used algorithm. Defaults to None.
+        """
+        visualize_grid(grid, t, trails=self.trails, done=done, name=name, checkpoints=self.checkpoints)
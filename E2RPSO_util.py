@@ -3,24 +3,11 @@
 
 import random
 import math
+import heapq
 import numpy as np
-
-def getFitness(gx, gy, x, y):
-    """Function that computes the fitness function
-
-    Args:
-        gx (float): x coordinate of the desired state
-        gy (float): y coordinate of the desired state
-        x (float): x coordinate of the agent
-        y (float): y coordinate of the agent
-
-    Returns:
-        float: value of fitness
-    """
-    dis = math.sqrt((gx - x) * (gx - x) + (gy - y) * (gy - y))
-    sq = math.sqrt(dis)
-
-    return math.sqrt(sq)
+import Fitness
+from Velocity import Limit_maxVelocity_all, Unit_speed_all
+from Collision import is_collision, is_collision_agents, is_collision_move, avoidObstacle, move_agents
 
 # update Gbest Pbest
 def update_GbestPbest(r, Gx, Gy, Gbest, goal_list_x, goal_list_y, t):
@@ -40,26 +27,7 @@ def update_GbestPbest(r, Gx, Gy, Gbest, goal_list_x, goal_list_y, t):
         float: y coorindate of the global best
         float: value of the global best
     """
-    gx = Gx
-    gy = Gy
-    gbest = Gbest
-    f = 0
-    for ttt in range(len(goal_list_x)):
-        tmp_f = getFitness(goal_list_x[ttt], goal_list_y[ttt], r.x, r.y)
-        f += tmp_f
-
-    if f <= r.pbest:
-        r.pbest_p = r.pbest
-        r.pbest = f
-        r.pbest_avg = (r.pbest_avg * t + f) / (t + 1)
-        r.px = r.x
-        r.py = r.y
-    if f <= gbest:
-        gbest = f
-        gx = r.px
-        gy = r.py
-
-    return gbest, gx, gy
+    return Fitness.update_best(r.array, r.index, Gx, Gy, Gbest, goal_list_x, goal_list_y, t)
 
 # limit max velocity
 def Limit_maxVelocity(v_x, v_y, v_limit):
@@ -108,131 +76,363 @@ def Unit_speed(r, gx, gy):
         yg = yg / g_len
     return xp, yp, xg, yg
 
-def is_collision(grid, x, y, radius):
-    """Check if a point (x,y) with given radius collides with any obstacle
+def update_GbestPbest_all(agent_array, Gx, Gy, Gbest, goal_list_x, goal_list_y, t):
+    """Updates the personal best of all agents at once and the global best across all agents,
+    with the same outcome as calling update_GbestPbest for the agents in order
 
     Args:
-        grid (Grid): instance of Grid
-        x (float): x coordinate of the agent
-        y (float): y coordinate of the agent
-        radius (int): sensing range of the agent
+        agent_array (AgentArray): the agents
+        Gx (float): x coordinate of the global best
+        Gy (float): y coorindate of the global best
+        Gbest (float): value of the global best
+        goal_list_x (list): list containing the x coordinates of all goals
+        goal_list_y (list): list containing the y coordinates of all goals
+        t (int): current timestep
 
     Returns:
-        Bool: True if there is a collision, false otherwise
+        float: value of the global best
+        float: x coordinate of the global best
+        float: y coorindate of the global best
     """
-    # Check bounds
-    if x - radius < 0 or x + radius > grid.width or y - radius < 0 or y + radius > grid.height:
-        return True
-
-    # Check obstacles
-    for obs_x, obs_y, obs_w, obs_h in grid.obstacles:   
-        
-        # Calculate closest point on rectangle to circle center
-        closest_x = max(obs_x - obs_w, min(x, obs_x + obs_w))
-        closest_y = max(obs_y - obs_h, min(y, obs_y + obs_h))
-        
-        # Calculate distance between closest point and circle center
-        distance = math.sqrt((x - closest_x) ** 2 + (y - closest_y) ** 2)
-        
-        # Check collision
-        if distance < radius:
-            return True
-    
-    return False
-
-def is_collision_agents(agent_self, grid, x, y, radius):
-    """Check if a point (x,y) with given radius collides with any agent
+    return Fitness.update_bests(agent_array, Gx, Gy, Gbest, goal_list_x, goal_list_y, t)
 
-    Args:
-        agent_self (Agent): instacne of class Agent
-        grid (Grid): instance of a grid
-        x (float): x coordinate of the agent
-        y (float): y coordinate of the agent
-        radius (int): sensing range of the agent
-
-    Returns:
-        Bool: True if there is a collision, false otherwise
-    """    # Check bounds
-    if x - radius < 0 or x + radius > grid.width or y - radius < 0 or y + radius > grid.height:
-        return True
-
-    # Check obstacles
-    for agent in grid.agents: 
-        if agent != agent_self:
-            ag_x = agent.x
-            ag_y = agent.y
-            ag_w = agent.half_size 
-            ag_h = agent.half_size  
-            
-            # Calculate closest point on rectangle to circle center
-            closest_x = max(ag_x - ag_w, min(x, ag_x + ag_w))
-            closest_y = max(ag_y - ag_h, min(y, ag_y + ag_h))
-            
-            # Calculate distance between closest point and circle center
-            distance = math.sqrt((x - closest_x) ** 2 + (y - closest_y) ** 2)
-            
-            # Check collision
-            if distance < radius:
-                return True
-        
-    return False
-
-# Avoid obstacle
-def avoidObstacle(r, v_x, v_y, V_LIMIT, grid):
-    """Function that computes how to avoid the obstacle
+def step_synchronous(grid, Out_map, far_area_id_list, gx, gy, gbest, goal_list_x, goal_list_y, steps, V_LIMIT, avoid, C1, C2, C3, K, uf):
+    """One synchronous E2RPSO step of the whole swarm.
+    All agents compute their velocity from the state at the start of the step, so every agent sees the same global best
+    and the same exploration rates. All moves are then resolved in one batch with move_agents, the agents that are
+    blocked call avoid one at a time, and the bests are updated for all agents at once.
+    The random numbers come from np.random instead of random, so a run differs from the asynchronous update.
 
     Args:
-        r (Agent): instance of Agent
-        v_x (float): x velocity
-        v_y (float): y velocity
+        grid (Grid): Instance of the grid
+        Out_map (ExplorationMap): exploration rates of the areas, updated in place
+        far_area_id_list (array): farthest & emptiest area of every agent, updated in place
+        gx (float): x coordinate of the global best
+        gy (float): y coordinate of the global best
+        gbest (float): value of the global best
+        goal_list_x (list): list containing the x coordinates of all goals
+        goal_list_y (list): list containing the y coordinates of all goals
+        steps (int): current timestep
         V_LIMIT (float): maximum velocity
-        grid (Grid): instance of a grid
+        avoid (function): obstacle avoidance for the blocked agents
+        C1 (float): learning constant towards the personal best
+        C2 (float): learning constant towards the global best
+        C3 (float): learning constant towards the farthest & emptiest area
+        K (int): exploration rate decrement of a visit
+        uf (int): update frequency of the farthest & emptiest areas
 
     Returns:
-        float: New computed values to avoid obstacles
+        float: value of the global best
+        float: x coordinate of the global best
+        float: y coorindate of the global best
     """
-    # x,y direction
-    angle_list = [10, -10, 20, -20, 30, -30, 40, -40, 50, -50, 60, -60, 70, -70, 80, -80, 90, -90, 100, -100,
-                    110, -110, 120, -120, 130, -130, 140, -140, 150, -150, 160, -160, 170, -170, 180, -180]
-    
-    for magnitude in [V_LIMIT * f for f in [1.0, 0.8, 0.6, 0.4, 0.2]]:
-        for angle in angle_list:
-            theta = math.atan2(v_y, v_x) + math.radians(angle)
-            ndx = math.cos(theta) * magnitude
-            ndy = math.sin(theta) * magnitude
-
-            new_x = r.x + ndx
-            new_y = r.y + ndy
-
-            if not (is_collision(grid, new_x, new_y, r.radius) or is_collision_agents(r, grid, new_x, new_y, r.radius)):
-                return new_x, new_y, ndx, ndy
-    return r.x, r.y, 0.0, 0.0
+    a = grid.agent_array
+    r1, r2, r3 = np.random.uniform(0, 1, size=(3, a.count))
+
+    # update inertial component
+    best_avg = a.pbest.mean()
+    w = 0.9 - 0.5 * (1 - (np.minimum(a.pbest_p, a.pbest) / np.maximum(a.pbest_p, a.pbest))) + (
+                min(gbest, best_avg) / max(gbest, best_avg))
+
+    # Find the farthest & emptiest area
+    area_id = Out_map.area_id(a.x, a.y)
+    Out_map.visit(area_id, K)
+    if steps % uf == 0:
+        for agent_idx in range(a.count):
+            far_area_id_list[agent_idx] = find_FarthestAndEmptiestArea(area_id[agent_idx], Out_map)
+            # farthest & emptiest exploration rate increment - K
+            Out_map.visit(far_area_id_list[agent_idx], K)
+
+    # Determine whether to enter local optimum or not, then set C3
+    rate = Out_map.rate_of(area_id)
+    explore = rate < 25
+    c1 = np.where(explore, 0, C1)
+    c2 = np.where(explore, 0, C2)
+    c3 = np.where(rate <= 0, 2 * C3, np.where(explore, C3, 0))
+
+    # prepare for unit speed x,y component
+    pu_x, pu_y = Out_map.center(far_area_id_list)
+
+    # Unit speed for x and y component
+    xp, yp, xg, yg = Unit_speed_all(a, gx, gy)
+
+    # update velocity, using E2RPSO
+    dist = np.hypot(pu_x - a.x, pu_y - a.y)
+    dist[dist == 0] = 1
+    v_x = w * a.Vx + r1 * c1 * xp + c2 * r2 * xg + c3 * r3 * ((pu_x - a.x)/dist)
+    v_y = w * a.Vy + r1 * c1 * yp + c2 * r2 * yg + c3 * r3 * ((pu_y - a.y)/dist)
+
+    # limit max velocity
+    v_x, v_y = Limit_maxVelocity_all(v_x * 100, v_y * 100, V_LIMIT)
+
+    # update position, the blocked agents avoid the obstacle one at a time
+    moved = move_agents(grid, v_x, v_y)
+    for agent_idx in np.flatnonzero(~moved):
+        r = a.agents[agent_idx]
+        new_x, new_y, v_x[agent_idx], v_y[agent_idx] = avoid(r, v_x[agent_idx], v_y[agent_idx], V_LIMIT, grid)
+        r.setcoords(new_x, new_y)
+
+    a.setVelocity(v_x, v_y)
+
+    # update Pbest & Gbest
+    return update_GbestPbest_all(a, gx, gy, gbest, goal_list_x, goal_list_y, steps)
+
+class ExplorationMap:
+    def __init__(self, width, height, area_size=10, rate=50):
+        """Initialization of the ExplorationMap class.
+        The map divides the grid in square areas and keeps the exploration rate of every area in a 2-D array, row by row.
+        An area is identified by its index in the flattened array. 
+        The distances from an area to all other areas are computed once and cached.
+
+        Args:
+            width (int): width of the grid
+            height (int): height of the grid
+            area_size (float, optional): width and height of an area. Defaults to 10.
+            rate (int, optional): initial exploration rate of every area. Defaults to 50.
+        """
+        self.area_size = area_size
+        self.rows = max(1, int(height / area_size))
+        self.cols = max(1, int(width / area_size))
+        self.rate = np.full((self.rows, self.cols), rate)
+        self.row_of = np.repeat(np.arange(self.rows), self.cols)
+        self.col_of = np.tile(np.arange(self.cols), self.rows)
+        self.distances = {}
+
+    def area_id(self, x, y):
+        """Function that returns the area of one or more positions
+
+        Args:
+            x (float, array): x coordinates
+            y (float, array): y coordinates
+
+        Returns:
+            int, array: index of the area
+        """
+        row = np.clip(np.trunc((np.asarray(y) - 1) / self.area_size).astype(int), 0, self.rows - 1)
+        col = np.clip(np.trunc(np.asarray(x) / self.area_size).astype(int), 0, self.cols - 1)
+        return row * self.cols + col
+
+    def visit(self, area_id, K):
+        """Function that lowers the exploration rate of one or more areas, an area can appear more than once
+
+        Args:
+            area_id (int, array): index of the areas
+            K (int): exploration rate decrement of a visit
+        """
+        np.subtract.at(self.rate.ravel(), area_id, K)
+
+    def rate_of(self, area_id):
+        """Function that returns the exploration rate of one or more areas
+
+        Args:
+            area_id (int, array): index of the areas
+
+        Returns:
+            int, array: exploration rate
+        """
+        return self.rate.ravel()[area_id]
+
+    def center(self, area_id):
+        """Function that returns the center of one or more areas
+
+        Args:
+            area_id (int, array): index of the areas
+
+        Returns:
+            float, array: x coordinate of the center
+            float, array: y coordinate of the center
+        """
+        return (self.col_of[area_id] + 0.5) * self.area_size, (self.row_of[area_id] + 0.5) * self.area_size
+
+    def distance(self, area_id):
+        """Function that returns the distance from an area to every area, in areas
+
+        Args:
+            area_id (int): index of the area
+
+        Returns:
+            array: distance to every area
+        """
+        row = self.distances.get(area_id)
+        if row is None:
+            row = np.hypot(self.row_of - self.row_of[area_id], self.col_of - self.col_of[area_id])
+            self.distances[area_id] = row
+        return row
+
+    def farthest_emptiest(self, area_id):
+        """Function that returns the farthest of the areas with the highest exploration rate
+
+        Args:
+            area_id (int): current area
+
+        Returns:
+            int: farthest & emptiest area, the lowest index if there is a tie
+        """
+        rate = self.rate.ravel()
+        emptiest = rate == rate.max()
+        return int(np.argmax(np.where(emptiest, self.distance(int(area_id)), -1)))
+
+class ExplorationPyramid(ExplorationMap):
+    def __init__(self, width, height, area_size=10, rate=50):
+        """Initialization of the ExplorationPyramid class.
+        An ExplorationMap that also keeps a pyramid of coarser levels, every level halves the rows and columns 
+        and holds the highest exploration rate of the 2x2 areas below it, up to a single top cell.
+        A visit updates the cells above the visited areas, and the farthest & emptiest area is found with 
+        a best-first descent of the pyramid that skips the cells without an emptiest area or that are too close, 
+        so no distances are cached and large maps need no scan of all areas.
+
+        Args:
+            width (int): width of the grid
+            height (int): height of the grid
+            area_size (float, optional): width and height of an area. Defaults to 10.
+            rate (int, optional): initial exploration rate of every area. Defaults to 50.
+        """
+        super().__init__(width, height, area_size, rate)
+        self.levels = [self.rate]
+        while self.levels[-1].shape != (1, 1):
+            child = self.levels[-1]
+            rows, cols = child.shape
+            r = np.arange(0, rows, 2)
+            c = np.arange(0, cols, 2)
+            r1 = np.minimum(r + 1, rows - 1)
+            c1 = np.minimum(c + 1, cols - 1)
+            self.levels.append(np.maximum(np.maximum(child[np.ix_(r, c)], child[np.ix_(r, c1)]),
+                                          np.maximum(child[np.ix_(r1, c)], child[np.ix_(r1, c1)])))
+
+    def visit(self, area_id, K):
+        """Function that lowers the exploration rate of one or more areas, an area can appear more than once, 
+        and updates the cells of the pyramid above them
+
+        Args:
+            area_id (int, array): index of the areas
+            K (int): exploration rate decrement of a visit
+        """
+        super().visit(area_id, K)
+        area_id = np.unique(area_id)
+        r = self.row_of[area_id]
+        c = self.col_of[area_id]
+        for child, parent in zip(self.levels, self.levels[1:]):
+            rows, cols = child.shape
+            # a clipped index points to the cell itself, which does not change the maximum
+            r, c = np.unique(np.stack((r // 2, c // 2)), axis=1)
+            r1 = np.minimum(2 * r + 1, rows - 1)
+            c1 = np.minimum(2 * c + 1, cols - 1)
+            parent[r, c] = np.maximum(np.maximum(child[2 * r, 2 * c], child[2 * r, c1]),
+                                      np.maximum(child[r1, 2 * c], child[r1, c1]))
+
+    def farthest_emptiest(self, area_id):
+        """Function that returns the farthest of the areas with the highest exploration rate, 
+        the same area as ExplorationMap.farthest_emptiest
+
+        Args:
+            area_id (int): current area
+
+        Returns:
+            int: farthest & emptiest area, the lowest index if there is a tie
+        """
+        top = len(self.levels) - 1
+        emptiest = self.levels[top][0, 0]
+        row = int(self.row_of[area_id])
+        col = int(self.col_of[area_id])
+
+        # squared distances in areas are integers, so ties are exact
+        best_d = -1
+        best_id = 0
+        heap = [(0, top, 0, 0)]
+        while heap:
+            bound, level, r, c = heapq.heappop(heap)
+            if -bound < best_d:
+                break
+            if level == 0:
+                d = (r - row) ** 2 + (c - col) ** 2
+                area = r * self.cols + c
+                if d > best_d or (d == best_d and area < best_id):
+                    best_d = d
+                    best_id = area
+                continue
+            child = self.levels[level - 1]
+            rows, cols = child.shape
+            size = 1 << (level - 1)
+            for cr in range(2 * r, min(2 * r + 2, rows)):
+                for cc in range(2 * c, min(2 * c + 2, cols)):
+                    if child[cr, cc] != emptiest:
+                        continue
+                    # farthest area covered by the child cell
+                    low_r = cr * size
+                    high_r = min(low_r + size, self.rows) - 1
+                    low_c = cc * size
+                    high_c = min(low_c + size, self.cols) - 1
+                    dr = max(row - low_r, high_r - row)
+                    dc = max(col - low_c, high_c - col)
+                    heapq.heappush(heap, (-(dr * dr + dc * dc), level - 1, cr, cc))
+        return best_id
+
+class ExplorationQueue(ExplorationMap):
+    def __init__(self, width, height, area_size=10, rate=50):
+        """Initialization of the ExplorationQueue class.
+        An ExplorationMap that also keeps the top bucket, the sorted areas with the highest exploration rate.
+        The rates only decrease, so a visit can only take areas out of the top bucket and never adds any. 
+        The visited areas are dropped from the bucket at the next search, and only when the bucket is empty 
+        the next one is collected from the map. The farthest & emptiest area is found among the areas of 
+        the top bucket only, without a distance cache.
+
+        Args:
+            width (int): width of the grid
+            height (int): height of the grid
+            area_size (float, optional): width and height of an area. Defaults to 10.
+            rate (int, optional): initial exploration rate of every area. Defaults to 50.
+        """
+        super().__init__(width, height, area_size, rate)
+        self.top = rate
+        self.emptiest = np.arange(self.rows * self.cols)
+        self.stale = False
+
+    def visit(self, area_id, K):
+        """Function that lowers the exploration rate of one or more areas, an area can appear more than once
+
+        Args:
+            area_id (int, array): index of the areas
+            K (int): exploration rate decrement of a visit
+        """
+        super().visit(area_id, K)
+        self.stale = True
+
+    def farthest_emptiest(self, area_id):
+        """Function that returns the farthest of the areas with the highest exploration rate, 
+        the same area as ExplorationMap.farthest_emptiest
+
+        Args:
+            area_id (int): current area
+
+        Returns:
+            int: farthest & emptiest area, the lowest index if there is a tie
+        """
+        if self.stale:
+            rate = self.rate.ravel()
+            self.emptiest = self.emptiest[rate[self.emptiest] == self.top]
+            if self.emptiest.size == 0:
+                self.top = rate.max()
+                self.emptiest = np.flatnonzero(rate == self.top)
+            self.stale = False
+        emptiest = self.emptiest
+        distance = np.hypot(self.row_of[emptiest] - self.row_of[area_id], self.col_of[emptiest] - self.col_of[area_id])
+        # the bucket is sorted, so argmax returns the lowest index of the farthest areas
+        return int(emptiest[np.argmax(distance)])
 
 # Find the farthest & emptiest area
-def find_FarthestAndEmptiestArea(area_id, Out_list):
-    """Find the area that has yet to be explored
+def find_FarthestAndEmptiestArea(area_id, Out_map):
+    """Find the area that has yet to be explored, the farthest of the areas with the highest exploration rate
 
     Args:
         area_id (int): current area
-        Out_list (list): list containing the differnt areas
+        Out_map (ExplorationMap): exploration rates of the areas
 
     Returns:
         int: area that has to be traveled to
     """
-    # Get current robot's position area
-    far_area_id = 0
-    tmp_d = 0
+    return Out_map.farthest_emptiest(area_id)
 
-    # Find the farthest & emptiest area
-    for j in range(len(Out_list)):
-        x_d = abs(area_id % 10 - j % 10)
-        y_d = int(abs(area_id - j) / 10)
-        dis = math.sqrt(x_d * x_d + y_d * y_d)
-        if Out_list[j] >= Out_list[far_area_id]:
-            if dis > tmp_d:
-                far_area_id = j
-                tmp_d = dis
-    return far_area_id
+EXPLORATION_MAPS = {'flat': ExplorationMap, 'queue': ExplorationQueue, 'pyramid': ExplorationPyramid}
 
 def update_best_avg(agents):
     """Function that updates the best average among the agents
@@ -250,15 +450,19 @@ def update_best_avg(agents):
     best_avg = best_avg / len(agents)
     return best_avg
 
-def init_E2RPSO(step_size, grid):
+def init_E2RPSO(step_size, grid, area_size=10, exploration_map='queue'):
     """Init function for the E2RPSO algorithm
 
     Args:
         step_size (float): Maximum velocity
         grid (Grid): instance of Grid
+        area_size (float, optional): width and height of the areas of the exploration map. Defaults to 10.
+        exploration_map (str, optional): 'flat' keeps the exploration rates in one array with cached distances, 
+            'queue' keeps the areas with the highest rate, see ExplorationQueue, 
+            'pyramid' adds coarser levels for large maps, see ExplorationPyramid. Defaults to 'queue'.
 
     Returns:
-            list: Out list
+            ExplorationMap: exploration rates of the areas
             list: List of agent objects after initialization.
             list: List of x-coordinates of goal positions.
             list: List of y-coordinates of goal positions.
@@ -266,10 +470,8 @@ def init_E2RPSO(step_size, grid):
             float: y-coordinate of the global best position.
             float: Best (lowest) fitness value found globally.
     """
-    Out_list = []
     # init Map area exploration rate
-    for _ in range(int(grid.width / 10) * int(grid.height / 10)):
-        Out_list.append(50)
+    Out_map = EXPLORATION_MAPS[exploration_map](grid.width, grid.height, area_size)
 
     for agent in grid.agents:
         agent.setVelocity(random.uniform(0, step_size), random.uniform(-step_size, step_size))
@@ -277,28 +479,10 @@ def init_E2RPSO(step_size, grid):
     # init gx,gy,gbest
     gbest = np.inf
 
-    goal_list_x = []
-    goal_list_y = []
-    for x, y, _ in grid.targets:
-        goal_list_x.append(x)
-        goal_list_y.append(y)
+    goal_list_x, goal_list_y = grid.target_store.positions()
 
     # init Gbest Pbest
-    for agent in grid.agents:
-        f = 0
-        for ttt in range(len(goal_list_x)):
-            tmp_f = getFitness(goal_list_x[ttt], goal_list_y[ttt], agent.x, agent.y)
-            f += tmp_f
-
-        if f < agent.pbest:
-            agent.pbest = f
-            agent.px = agent.x
-            agent.py = agent.y
-            if f < gbest:
-                gbest = f
-                gx = agent.px
-                gy = agent.py
-
-
-    return Out_list,grid.agents,goal_list_x,goal_list_y,gx,gy,gbest
+    gbest, gx, gy = Fitness.init_bests(grid.agent_array, None, None, gbest, goal_list_x, goal_list_y)
+
+    return Out_map,grid.agents,goal_list_x,goal_list_y,gx,gy,gbest
 
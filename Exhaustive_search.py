@@ -1,67 +1,8 @@
-from Continuous_grid import Grid, Agent, visualize_grid
+from Continuous_grid import Grid, Agent, InteractiveSink
 import random
 import math
 import numpy as np
-
-def check_target_detection(grid):
-    """Check if an agent has detected any target
-
-    Args:
-        grid (Grid): Instance of Grid
-
-    Returns:
-        Bool: True if a target is detected, False otherwise. 
-    """
-    for agent in grid.agents:
-        for i, target in enumerate(grid.targets):
-            if target is None:  # Skip already found targets
-                continue
-                
-            target_x, target_y, target_radius = target
-            
-            # Calculate distance between agent and target centers
-            distance = math.sqrt((agent.x - target_x) ** 2 + (agent.y - target_y) ** 2)
-            
-            # Check if agent's detection radius overlaps with target
-            if distance < grid.agents[0].radius + grid.target_half_size + 3:
-                agent.targets_found += 1
-                grid.remove_target(target_x, target_y, target_radius)
-                grid.targets[i] = None  # Mark target as found
-                return True
-        
-    return False
-
-def is_collision(grid, x, y, radius):
-    """Check if a point (x,y) with given radius collides with any obstacle
-
-    Args:
-        grid (Grid): instance of Grid
-        x (float): x coordinate of the agent
-        y (float): y coordinate of the agent
-        radius (int): sensing range of the agent
-
-    Returns:
-        Bool: True if there is a collision, false otherwise
-    """
-    # Check bounds
-    if x - radius < 0 or x + radius > grid.width or y - radius < 0 or y + radius > grid.height:
-        return True
-
-    # Check obstacles
-    for obs_x, obs_y, obs_w, obs_h in grid.obstacles:   
-        
-        # Calculate closest point on rectangle to circle center
-        closest_x = max(obs_x - obs_w, min(x, obs_x + obs_w))
-        closest_y = max(obs_y - obs_h, min(y, obs_y + obs_h))
-        
-        # Calculate distance between closest point and circle center
-        distance = math.sqrt((x - closest_x) ** 2 + (y - closest_y) ** 2)
-        
-        # Check collision
-        if distance < radius:
-            return True
-    
-    return False
+from Collision import is_collision_move
 
 def divisors(n):
     """function that returns a list of all positive integers that divide a given number n evenly
@@ -89,7 +30,7 @@ def move(agent, dx, dy, grid):
     new_x = agent.x + dx
     new_y = agent.y + dy
     # Check if new position would cause collision
-    if not is_collision(grid, new_x, new_y, agent.radius):
+    if not is_collision_move(agent, grid, new_x, new_y, agents=False):
 
         # Update agent position
         agent.setcoords(new_x, new_y)        
@@ -97,81 +38,253 @@ def move(agent, dx, dy, grid):
 
     return False
 
-def exhaustive_search(grid, max_steps=1000, step_size=2):
+# Search patterns of the most recent scenarios, the least recently used one is dropped first
+PATTERNS = {}
+PATTERNS_SIZE = 8
+
+def search_regions(grid):
+    """Function that divides the grid into rectangular regions, one for each agent
+
+    Args:
+        grid (Grid): instance of the grid
+
+    Returns:
+        list: (x_min, x_max, y_min, y_max) of every region
+    """
+    num_agents = grid.number_agents
+    if num_agents == 1:
+        return [(0, grid.width, 0, grid.height)]
+
+    # Try to create a grid of regions
+    divisors_list = divisors(num_agents)
+    rows = divisors_list[len(divisors_list)//2]
+    cols = num_agents // rows
+    
+    width_per_region = grid.width / cols
+    height_per_region = grid.height / rows
+    
+    regions = []
+    for i in range(rows):
+        for j in range(cols):
+            if len(regions) < num_agents:
+                regions.append((
+                    j * width_per_region,  # x_min
+                    (j + 1) * width_per_region,  # x_max
+                    i * height_per_region,  # y_min
+                    (i + 1) * height_per_region   # y_max
+                ))
+    return regions
+
+def zigzag_pattern(x_min, x_max, y_min, y_max, step):
+    """Function that creates the waypoints of a zigzag over a region, rows alternate left-to-right and right-to-left
+
+    Args:
+        x_min (float): left side of the region
+        x_max (float): right side of the region
+        y_min (float): bottom of the region
+        y_max (float): top of the region
+        step (float): distance between the waypoints and between the rows
+
+    Returns:
+        array: x coordinates of the waypoints
+        array: y coordinates of the waypoints
+    """
+    # Calculate number of points to create in each dimension
+    x_points = int(max(2, int((x_max - x_min)))//step)
+    y_points = int(max(2, int((y_max - y_min)))//step)
+
+    y_idx = np.repeat(np.arange(y_points), x_points)
+    x_idx = np.tile(np.arange(x_points), y_points)
+    x_idx = np.where(y_idx % 2 == 0, x_idx, x_points - 1 - x_idx)
+    return x_min + (x_idx + 0.5) * step, y_min + (y_idx + 0.5) * step
+
+def free_intervals(obstacle_set, y, x_min, x_max, radius):
+    """Function that returns the parts of a horizontal line where a circle fits between the obstacles
+
+    Args:
+        obstacle_set (ObstacleSet): the obstacles
+        y (float): y coordinate of the line
+        x_min (float): left end of the line
+        x_max (float): right end of the line
+        radius (float): radius of the circle
+
+    Returns:
+        list: (start, end) of the free intervals, from left to right
+    """
+    idx = obstacle_set.candidates(x_min - radius, x_max + radius, y - radius, y + radius)
+    dy = np.maximum(0, np.abs(y - obstacle_set.y[idx]) - obstacle_set.half_height[idx])
+    near = dy < radius
+    idx = idx[near]
+
+    # Every obstacle blocks its width plus the part of the circle that reaches over its side at this height
+    dx = np.sqrt(radius * radius - dy[near] * dy[near])
+    low = obstacle_set.x[idx] - obstacle_set.half_width[idx] - dx
+    high = obstacle_set.x[idx] + obstacle_set.half_width[idx] + dx
+
+    intervals = []
+    start = x_min
+    for l, h in sorted(zip(low.tolist(), high.tolist())):
+        if l > start:
+            intervals.append((start, min(l, x_max)))
+        start = max(start, h)
+        if start >= x_max:
+            break
+    if start < x_max:
+        intervals.append((start, x_max))
+    return [(l, h) for l, h in intervals if h > l]
+
+def sweep_cells(rows, intervals):
+    """Function that joins the free intervals of consecutive rows into cells of a boustrophedon decomposition.
+    An interval continues a cell when it overlaps only the last interval of that cell, and that interval overlaps only this one.
+    Where an obstacle starts or ends the connection splits or merges, and new cells start.
+
+    Args:
+        rows (list): y coordinates of the rows
+        intervals (list): free intervals of every row
+
+    Returns:
+        list: cells as lists of (y, start, end), from bottom to top
+    """
+    cells = []
+    open_cells = []
+    for y, row in zip(rows, intervals):
+        overlaps = [[j for j, (l, h) in enumerate(row) if l < cell[-1][2] and cell[-1][1] < h] for cell in open_cells]
+        count = [0] * len(row)
+        for found in overlaps:
+            for j in found:
+                count[j] += 1
+
+        next_cells = [None] * len(row)
+        for cell, found in zip(open_cells, overlaps):
+            if len(found) == 1 and count[found[0]] == 1:
+                next_cells[found[0]] = cell
+        for j, (l, h) in enumerate(row):
+            if next_cells[j] is None:
+                next_cells[j] = []
+                cells.append(next_cells[j])
+            next_cells[j].append((y, l, h))
+        open_cells = next_cells
+    return cells
+
+def boustrophedon_pattern(obstacle_set, region, step, radius, width, height):
+    """Function that creates the waypoints of a boustrophedon coverage of the free space of a region.
+    The rows are cut into free intervals around the obstacles, the intervals are joined into cells, 
+    and every cell is swept back and forth on its own. The next cell is the one with the closest 
+    corner to the end of the previous sweep, starting from the bottom left of the region.
+
+    Args:
+        obstacle_set (ObstacleSet): the obstacles
+        region (tuple): (x_min, x_max, y_min, y_max) of the region
+        step (float): distance between the waypoints and between the rows
+        radius (float): radius of the agents
+        width (int): width of the grid
+        height (int): height of the grid
+
+    Returns:
+        array: x coordinates of the waypoints
+        array: y coordinates of the waypoints
+    """
+    x_min, x_max, y_min, y_max = region
+    x_min = max(x_min, radius)
+    x_max = min(x_max, width - radius)
+    y_min = max(y_min, radius)
+    y_max = min(y_max, height - radius)
+    if x_max <= x_min or y_max <= y_min:
+        return np.zeros(0), np.zeros(0)
+
+    # Rows evenly spread over the region, at most step apart
+    y_points = max(1, math.ceil((y_max - y_min) / step))
+    rows = [y_min + (y_max - y_min) * (y_idx + 0.5) / y_points for y_idx in range(y_points)]
+    cells = sweep_cells(rows, [free_intervals(obstacle_set, y, x_min, x_max, radius) for y in rows])
+
+    pattern_x = []
+    pattern_y = []
+    at_x, at_y = region[0], region[2]
+    while cells:
+        # Closest start: the first or last row of a cell, from its left or right end
+        starts = [(math.hypot(cell[r][1 + e] - at_x, cell[r][0] - at_y), c, r, e)
+                  for c, cell in enumerate(cells) for r in (0, -1) for e in (0, 1)]
+        _, c, r, e = min(starts)
+        cell = cells.pop(c)
+        if r == -1:
+            cell = cell[::-1]
+        for y, l, h in cell:
+            # Waypoints evenly spread over the interval, at most step apart
+            x_points = max(1, math.ceil((h - l) / step))
+            xs = [l + (h - l) * (x_idx + 0.5) / x_points for x_idx in range(x_points)]
+            if e == 1:
+                xs = xs[::-1]
+            pattern_x.extend(xs)
+            pattern_y.extend([y] * len(xs))
+            e = 1 - e
+        at_x, at_y = pattern_x[-1], pattern_y[-1]
+    return np.array(pattern_x), np.array(pattern_y)
+
+def search_patterns(grid, agent_radius, planner='zigzag'):
+    """Function that creates the search pattern of every region, without the waypoints an agent cannot reach.
+    The waypoints of all regions are checked against the obstacles in one query. 
+    The patterns of the last PATTERNS_SIZE scenarios are cached, a grid with the same size, agents and obstacles reuses them.
+
+    Args:
+        grid (Grid): instance of the grid
+        agent_radius (float): radius of the agents
+        planner (str, optional): 'zigzag' lays a zigzag over every region, 'boustrophedon' sweeps the free space 
+            around the obstacles, see boustrophedon_pattern. Defaults to 'zigzag'.
+
+    Returns:
+        list: (x, y) arrays with the reachable waypoints of every region
+    """
+    obstacle_set = grid.obstacle_set
+    n = obstacle_set.count
+    key = (planner, grid.width, grid.height, grid.number_agents, agent_radius, obstacle_set.x[:n].tobytes(), obstacle_set.y[:n].tobytes(),
+           obstacle_set.half_width[:n].tobytes(), obstacle_set.half_height[:n].tobytes())
+    if key in PATTERNS:
+        PATTERNS[key] = PATTERNS.pop(key)
+        return PATTERNS[key]
+
+    step = agent_radius * 0.9
+    if planner == 'zigzag':
+        patterns = [zigzag_pattern(x_min, x_max, y_min, y_max, step) for x_min, x_max, y_min, y_max in search_regions(grid)]
+    elif planner == 'boustrophedon':
+        patterns = [boustrophedon_pattern(obstacle_set, region, step, agent_radius, grid.width, grid.height) for region in search_regions(grid)]
+    else:
+        raise ValueError(f"Unknown planner: {planner}")
+    px = np.concatenate([x for x, _ in patterns])
+    py = np.concatenate([y for _, y in patterns])
+    reachable = ~obstacle_set.query(np.column_stack((px, py)), agent_radius)
+
+    splits = np.cumsum([len(x) for x, _ in patterns])[:-1]
+    patterns = [(x[keep], y[keep]) for x, y, keep in zip(np.split(px, splits), np.split(py, splits), np.split(reachable, splits))]
+    if len(PATTERNS) >= PATTERNS_SIZE:
+        del PATTERNS[next(iter(PATTERNS))]
+    PATTERNS[key] = patterns
+    return patterns
+
+def exhaustive_search(grid, max_steps=1000, step_size=2, sink=None, planner='zigzag'):
     """Function that controls the process of exhaustive search
 
     Args:
         grid (Grid): Instance of the grid
         max_steps (int): maximum amount of steps. Defaults to 1000.
         step_size (int): maximum step size. Defaults to 2.
+        sink (NullSink, CheckpointSink, InteractiveSink, optional): receives the frames of the run. Defaults to InteractiveSink().
+        planner (str, optional): 'zigzag' or 'boustrophedon', the boustrophedon patterns are planned around the obstacles. Defaults to 'zigzag'.
 
     Returns:
         int: number of steps needed
         int: number of targets found
         float: distance covered by all the agents
     """
+    if sink is None:
+        sink = InteractiveSink()
     total_targets = len(grid.targets)
     targets_found = 0
     steps = 0
     
-    visualize_grid(grid, 0)
-    # Create search patterns for each agent
-    search_patterns = []
-    search_positions = []
-    
-    # We'll divide the grid into sections, one for each agent
-    num_agents = grid.number_agents
-    
-    # Calculate how to divide the grid
-    if num_agents == 1:
-        regions = [(0, grid.width, 0, grid.height)]
-    else:
-        # Try to create a grid of regions
-        divisors_list = divisors(num_agents)
-        rows = divisors_list[len(divisors_list)//2]
-        cols = num_agents // rows
-        
-        width_per_region = grid.width / cols
-        height_per_region = grid.height / rows
-        
-        regions = []
-        for i in range(rows):
-            for j in range(cols):
-                if len(regions) < num_agents:
-                    regions.append((
-                        j * width_per_region,  # x_min
-                        (j + 1) * width_per_region,  # x_max
-                        i * height_per_region,  # y_min
-                        (i + 1) * height_per_region   # y_max
-                    ))
-    # Create a search pattern for each region
-    for i, (x_min, x_max, y_min, y_max) in enumerate(regions):
-        if i >= num_agents:
-            break
-            
-        pattern = []
-        
-        hor_step = grid.agent_radius * 0.9
-        vert_step = grid.agent_radius * 0.9
-
-        # Calculate number of points to create in each dimension
-        x_points = int(max(2, int((x_max - x_min)))//hor_step)
-        y_points = int(max(2, int((y_max - y_min)))//vert_step)
-
-        # Create zigzag pattern: alternate left-to-right and right-to-left rows
-        for y_idx in range(y_points):
-            y = y_min + (y_idx + 0.5) * vert_step
-        
-            if y_idx % 2 == 0:  # Left to right
-                for x_idx in range(x_points):
-                    x = x_min + (x_idx + 0.5) * hor_step
-                    pattern.append((x, y))
-            else:  # Right to left
-                for x_idx in range(x_points - 1, -1, -1):
-                    x = x_min + (x_idx + 0.5) * hor_step
-                    pattern.append((x, y))
-        search_patterns.append(pattern)
-        search_positions.append(0)  # Start at the beginning of each pattern
+    sink.emit(grid, 0)
+    # Create a search pattern for each agent, the unreachable waypoints are left out
+    patterns = search_patterns(grid, grid.agent_radius, planner)
+    search_positions = [0] * len(patterns)
 
     stuck_counter = [0] * len(grid.agents)
     detour_steps = [0] * len(grid.agents)
@@ -185,21 +298,13 @@ def exhaustive_search(grid, max_steps=1000, step_size=2):
         
         # Move each agent according to its search pattern
         for agent_idx, agent in enumerate(grid.agents):
-            if agent_idx < len(search_patterns):
-                pattern = search_patterns[agent_idx]
+            if agent_idx < len(patterns):
+                pattern_x, pattern_y = patterns[agent_idx]
                 pos_idx = search_positions[agent_idx]
-
-                # Skip unreachable waypoints
-                while pos_idx < len(pattern):
-                    target_x, target_y = pattern[pos_idx]
-                    if not is_collision(grid, target_x, target_y, agent.radius):
-                        break
-                    else:
-                        search_positions[agent_idx] += 1
-                        pos_idx += 1
                 
-                if pos_idx < len(pattern):
-                    target_x, target_y = pattern[pos_idx]
+                if pos_idx < len(pattern_x):
+                    target_x = pattern_x.item(pos_idx)
+                    target_y = pattern_y.item(pos_idx)
 
                     dx = target_x - agent.x
                     dy = target_y - agent.y
@@ -280,11 +385,10 @@ def exhaustive_search(grid, max_steps=1000, step_size=2):
                 move(agent, dx, dy, grid)
             
         grid.pos_change()
-        if check_target_detection(grid):
-            targets_found += 1
+        targets_found += len(grid.detect_targets(margin = 3))
         # Optional: Visualize grid state periodically
         if steps % 10 == 0:
-            visualize_grid(grid, steps, name='Exhaustive')    
+            sink.emit(grid, steps, name='Exhaustive')    
         if targets_found == total_targets:
             break
 
@@ -292,7 +396,7 @@ def exhaustive_search(grid, max_steps=1000, step_size=2):
 
     
 
-    visualize_grid(grid, steps, name='Exhaustive') 
+    sink.emit(grid, steps, done = True, name='Exhaustive')
     
     return steps, targets_found, total_distance
 
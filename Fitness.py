@@ -0,0 +1,376 @@
+import math
+import numpy as np
+
+def fitness(x, y, goal_x, goal_y):
+    """Function that computes the fitness of many positions at once, the sum over all goals
+    of the fourth root of the distance to the goal
+
+    Args:
+        x (float, array): x coordinates, of any shape
+        y (float, array): y coordinates, of the same shape as x
+        goal_x (array): x coordinates of the goals
+        goal_y (array): y coordinates of the goals
+
+    Returns:
+        array: fitness of every position, of the same shape as x
+    """
+    dx = np.asarray(goal_x) - np.asarray(x, dtype=float)[..., None]
+    dy = np.asarray(goal_y) - np.asarray(y, dtype=float)[..., None]
+    return np.sqrt(np.sqrt(np.sqrt(dx * dx + dy * dy))).sum(axis=-1)
+
+def evaluate(agent_array, x, y, goal_x, goal_y):
+    """Function that computes the fitness of many positions with the fitness model of the agents,
+    the exact sum over the goals if they have none.
+    A fitness model always represents the remaining targets of grid.target_store, the Grid removes every detected target from it.
+    The goals are then ignored, so a caller that needs the fitness of another set of goals should use fitness.
+
+    Args:
+        agent_array (AgentArray): the agents
+        x (float, array): x coordinates, of any shape
+        y (float, array): y coordinates, of the same shape as x
+        goal_x (array): x coordinates of the goals, only used without a fitness model
+        goal_y (array): y coordinates of the goals, only used without a fitness model
+
+    Returns:
+        array: fitness of every position, of the same shape as x
+    """
+    if agent_array.fitness_model is None:
+        return fitness(x, y, goal_x, goal_y)
+    return agent_array.fitness_model.evaluate(x, y)
+
+def update_best(agent_array, index, Gx, Gy, Gbest, goal_x, goal_y, t=None):
+    """Updates the personal best of one agent and the global best, based on the fitness of its current position.
+    If t is given the previous personal best and the running average of the personal best are kept as well, as in E2RPSO.
+
+    Args:
+        agent_array (AgentArray): the agents
+        index (int): index of the agent
+        Gx (float): x coordinate of the global best
+        Gy (float): y coorindate of the global best
+        Gbest (float): value of the global best
+        goal_x (array): x coordinates of the goals
+        goal_y (array): y coordinates of the goals
+        t (int, optional): current timestep. Defaults to None.
+
+    Returns:
+        float: value of the global best
+        float: x coordinate of the global best
+        float: y coorindate of the global best
+    """
+    a = agent_array
+    x = a.x.item(index)
+    y = a.y.item(index)
+    f = evaluate(a, x, y, goal_x, goal_y).item()
+
+    pbest = a.pbest.item(index)
+    if f <= pbest:
+        if t is not None:
+            a.pbest_p[index] = pbest
+            with np.errstate(invalid='ignore'):
+                a.pbest_avg[index] = (a.pbest_avg[index] * t + f) / (t + 1)
+        a.pbest[index] = f
+        a.px[index] = x
+        a.py[index] = y
+    if f <= Gbest:
+        return f, a.px.item(index), a.py.item(index)
+    return Gbest, Gx, Gy
+
+def update_bests(agent_array, Gx, Gy, Gbest, goal_x, goal_y, t=None, x=None, y=None):
+    """Updates the personal best of all agents at once and the global best across all agents,
+    with the same outcome as calling update_best for the agents in order.
+    Every agent can offer several positions, they are taken in order, like the agents.
+
+    Args:
+        agent_array (AgentArray): the agents
+        Gx (float): x coordinate of the global best
+        Gy (float): y coorindate of the global best
+        Gbest (float): value of the global best
+        goal_x (array): x coordinates of the goals
+        goal_y (array): y coordinates of the goals
+        t (int, optional): current timestep, keeps pbest_p and pbest_avg as in E2RPSO. Defaults to None.
+        x (array, optional): positions of shape (agents, k). Defaults to None, the current position of the agents.
+        y (array, optional): positions of shape (agents, k). Defaults to None, the current position of the agents.
+
+    Returns:
+        float: value of the global best
+        float: x coordinate of the global best
+        float: y coorindate of the global best
+    """
+    a = agent_array
+    if x is None:
+        x = a.x[:, None]
+        y = a.y[:, None]
+    f = evaluate(a, x, y, goal_x, goal_y)
+
+    # The personal best of every agent after each of its positions
+    best_x = np.empty_like(f)
+    best_y = np.empty_like(f)
+    for j in range(f.shape[1]):
+        better = f[:, j] <= a.pbest
+        if t is not None:
+            a.pbest_p[better] = a.pbest[better]
+            with np.errstate(invalid='ignore'):
+                a.pbest_avg[better] = (a.pbest_avg[better] * t + f[better, j]) / (t + 1)
+        a.pbest[better] = f[better, j]
+        a.px[better] = x[better, j]
+        a.py[better] = y[better, j]
+        best_x[:, j] = a.px
+        best_y[:, j] = a.py
+
+    # In order, the last position with the lowest fitness would have set the global best
+    if f.size == 0:
+        return Gbest, Gx, Gy
+    f = f.ravel()
+    f_min = f.min()
+    if f_min <= Gbest:
+        i = np.flatnonzero(f == f_min)[-1]
+        return f_min.item(), best_x.ravel().item(i), best_y.ravel().item(i)
+    return Gbest, Gx, Gy
+
+def init_bests(agent_array, Gx, Gy, Gbest, goal_x, goal_y):
+    """Sets the personal bests of the agents at the start of a run and the global best,
+    only strict improvements count and the global best only looks at agents that improved
+
+    Args:
+        agent_array (AgentArray): the agents
+        Gx (float): x coordinate of the global best
+        Gy (float): y coorindate of the global best
+        Gbest (float): value of the global best
+        goal_x (array): x coordinates of the goals
+        goal_y (array): y coordinates of the goals
+
+    Returns:
+        float: value of the global best
+        float: x coordinate of the global best
+        float: y coorindate of the global best
+    """
+    a = agent_array
+    f = evaluate(a, a.x, a.y, goal_x, goal_y)
+
+    better = f < a.pbest
+    a.pbest[better] = f[better]
+    a.px[better] = a.x[better]
+    a.py[better] = a.y[better]
+
+    # In order, the first improved agent with the lowest fitness sets the global best
+    candidates = np.where(better, f, np.inf)
+    i = np.argmin(candidates) if len(candidates) > 0 else 0
+    if len(candidates) > 0 and candidates[i] < Gbest:
+        return candidates.item(i), a.px.item(i), a.py.item(i)
+    return Gbest, Gx, Gy
+
+class FitnessField:
+    def __init__(self, width, height, goal_x, goal_y, resolution=1):
+        """Initialization of the FitnessField class.
+        The fitness is computed once on the corners of a raster over the grid, a position is then looked up
+        by bilinear interpolation between the four corners around it. A found target only has its own contribution subtracted.
+
+        Args:
+            width (int): width of the grid
+            height (int): height of the grid
+            goal_x (array): x coordinates of the goals
+            goal_y (array): y coordinates of the goals
+            resolution (int, optional): raster corners per unit of length. Defaults to 1.
+        """
+        self.width = width
+        self.height = height
+        self.resolution = resolution
+        self.corner_x = np.arange(int(width * resolution) + 1) / resolution
+        self.corner_y = np.arange(int(height * resolution) + 1) / resolution
+        self.field = np.zeros((len(self.corner_y), len(self.corner_x)))
+
+        # Add the targets in blocks, to bound the memory of the (targets, rows, columns) array
+        goal_x = np.asarray(goal_x, dtype=float)
+        goal_y = np.asarray(goal_y, dtype=float)
+        block = max(1, 2 ** 22 // self.field.size)
+        for start in range(0, len(goal_x), block):
+            self.field += self.contribution(goal_x[start:start + block], goal_y[start:start + block]).sum(axis=0)
+
+    def contribution(self, goal_x, goal_y):
+        """Function that computes the fitness of every raster corner for some goals
+
+        Args:
+            goal_x (array): x coordinates of the goals
+            goal_y (array): y coordinates of the goals
+
+        Returns:
+            array: fitness of shape (goals, rows, columns)
+        """
+        dx = self.corner_x[None, None, :] - np.asarray(goal_x, dtype=float)[:, None, None]
+        dy = self.corner_y[None, :, None] - np.asarray(goal_y, dtype=float)[:, None, None]
+        return np.sqrt(np.sqrt(np.sqrt(dx * dx + dy * dy)))
+
+    def remove(self, target_id, x, y):
+        """Function that subtracts the contribution of a found target from the field
+
+        Args:
+            target_id (int): index of the target in the goals the field was built from
+            x (float): x coordinate of the target
+            y (float): y coordinate of the target
+        """
+        self.field -= self.contribution([x], [y])[0]
+
+    def evaluate(self, x, y):
+        """Function that looks up the fitness of many positions, positions outside the grid take the value of the border
+
+        Args:
+            x (float, array): x coordinates, of any shape
+            y (float, array): y coordinates, of the same shape as x
+
+        Returns:
+            array: fitness of every position, of the same shape as x
+        """
+        col = np.clip(np.asarray(x, dtype=float) * self.resolution, 0, len(self.corner_x) - 1)
+        row = np.clip(np.asarray(y, dtype=float) * self.resolution, 0, len(self.corner_y) - 1)
+        c0 = np.minimum(col.astype(int), len(self.corner_x) - 2)
+        r0 = np.minimum(row.astype(int), len(self.corner_y) - 2)
+        fc = col - c0
+        fr = row - r0
+
+        f = self.field
+        top = f[r0, c0] * (1 - fc) + f[r0, c0 + 1] * fc
+        bottom = f[r0 + 1, c0] * (1 - fc) + f[r0 + 1, c0 + 1] * fc
+        return top * (1 - fr) + bottom * fr
+
+class FitnessTree:
+    def __init__(self, width, height, goal_x, goal_y, tolerance=0.5, leaf_size=8):
+        """Initialization of the FitnessTree class, a Barnes-Hut approximation of the fitness.
+        The goals are grouped in a quadtree. A node that is small compared to its distance to a position counts
+        as all its goals sitting at their center of mass, the goals of the leaves that are too close are summed exactly.
+        The nodes of every level are sorted by Morton code, so the children of a node are a contiguous range
+        of the next level and all positions descend the tree together, one level at a time.
+
+        Args:
+            width (int): width of the grid
+            height (int): height of the grid
+            goal_x (array): x coordinates of the goals
+            goal_y (array): y coordinates of the goals
+            tolerance (float, optional): largest ratio of node size to distance for which a node is aggregated. Defaults to 0.5.
+            leaf_size (int, optional): average number of goals per leaf the depth is chosen for. Defaults to 8.
+        """
+        self.goal_x = np.array(goal_x, dtype=float)
+        self.goal_y = np.array(goal_y, dtype=float)
+        self.alive = np.ones(len(self.goal_x), dtype=bool)
+        self.tolerance = tolerance
+        n = len(self.goal_x)
+        self.depth = int(min(16, max(1, math.ceil(math.log(max(n, 1) / leaf_size, 4))))) if n > leaf_size else 1
+        self.size = max(width, height)
+
+        # Morton code of the leaf of every goal
+        cells = 2 ** self.depth
+        ix = np.clip((self.goal_x / self.size * cells).astype(np.int64), 0, cells - 1)
+        iy = np.clip((self.goal_y / self.size * cells).astype(np.int64), 0, cells - 1)
+        morton = np.zeros(n, dtype=np.int64)
+        for bit in range(self.depth):
+            morton |= ((ix >> bit) & 1) << (2 * bit)
+            morton |= ((iy >> bit) & 1) << (2 * bit + 1)
+
+        # Goals in leaf order, with the first goal and the number of goals of every leaf
+        self.order = np.argsort(morton, kind='stable')
+        sorted_morton = morton[self.order]
+
+        # Per level: sorted node codes, and per node the number of goals and the sums of their coordinates
+        self.codes = []
+        self.count = []
+        self.sum_x = []
+        self.sum_y = []
+        self.node_of = []
+        for level in range(self.depth + 1):
+            level_codes = sorted_morton >> (2 * (self.depth - level))
+            codes, first, node = np.unique(level_codes, return_index=True, return_inverse=True)
+            self.codes.append(codes)
+            self.count.append(np.bincount(node, minlength=len(codes)).astype(float))
+            self.sum_x.append(np.bincount(node, weights=self.goal_x[self.order], minlength=len(codes)))
+            self.sum_y.append(np.bincount(node, weights=self.goal_y[self.order], minlength=len(codes)))
+            node_of = np.empty(n, dtype=np.int64)
+            node_of[self.order] = node
+            self.node_of.append(node_of)
+        self.leaf_first = first
+        self.leaf_count = np.diff(np.append(first, n))
+
+    def remove(self, target_id, x, y):
+        """Function that removes a found goal from every node above it
+
+        Args:
+            target_id (int): index of the goal in the goals the tree was built from
+            x (float): x coordinate of the goal
+            y (float): y coordinate of the goal
+        """
+        self.alive[target_id] = False
+        for level in range(self.depth + 1):
+            node = self.node_of[level][target_id]
+            self.count[level][node] -= 1
+            self.sum_x[level][node] -= self.goal_x[target_id]
+            self.sum_y[level][node] -= self.goal_y[target_id]
+
+    def evaluate(self, x, y):
+        """Function that approximates the fitness of many positions
+
+        Args:
+            x (float, array): x coordinates, of any shape
+            y (float, array): y coordinates, of the same shape as x
+
+        Returns:
+            array: fitness of every position, of the same shape as x
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        shape = x.shape
+        px = x.ravel()
+        py = y.ravel()
+        total = np.zeros(len(px))
+        if len(self.codes[0]) == 0:
+            return total.reshape(shape)
+
+        # (position, node) pairs that still have to be opened, all positions start at the root
+        point = np.arange(len(px))
+        node = np.zeros(len(px), dtype=np.int64)
+        for level in range(self.depth + 1):
+            count = self.count[level][node]
+            keep = count > 0
+            point, node, count = point[keep], node[keep], count[keep]
+            if level == self.depth:
+                break
+
+            # Aggregate the nodes that are small compared to their distance
+            cx = self.sum_x[level][node] / count
+            cy = self.sum_y[level][node] / count
+            d = np.sqrt((px[point] - cx) ** 2 + (py[point] - cy) ** 2)
+            far = self.size / 2 ** level < self.tolerance * d
+            total += np.bincount(point[far], weights=count[far] * np.sqrt(np.sqrt(d[far])), minlength=len(px))
+
+            # Open the other nodes, their children are the next level's codes 4 * code ... 4 * code + 3
+            point, node = point[~far], node[~far]
+            codes = self.codes[level + 1]
+            start = np.searchsorted(codes, self.codes[level][node] * 4)
+            children = np.searchsorted(codes, self.codes[level][node] * 4 + 4) - start
+            point = np.repeat(point, children)
+            node = np.repeat(start - np.cumsum(children) + children, children) + np.arange(children.sum())
+
+        # Sum the goals of the leaves that were reached exactly
+        first = self.leaf_first[node]
+        members = self.leaf_count[node]
+        point = np.repeat(point, members)
+        goal = self.order[np.repeat(first - np.cumsum(members) + members, members) + np.arange(members.sum())]
+        live = self.alive[goal]
+        point, goal = point[live], goal[live]
+        dx = px[point] - self.goal_x[goal]
+        dy = py[point] - self.goal_y[goal]
+        total += np.bincount(point, weights=np.sqrt(np.sqrt(np.sqrt(dx * dx + dy * dy))), minlength=len(px))
+        return total.reshape(shape)
+
+    def error(self, x, y):
+        """Function that reports the error of the approximation against the exact sum over the goals that are left
+
+        Args:
+            x (float, array): x coordinates, of any shape
+            y (float, array): y coordinates, of the same shape as x
+
+        Returns:
+            array: absolute error at every position
+            array: error relative to the exact fitness at every position
+        """
+        exact = fitness(x, y, self.goal_x[self.alive], self.goal_y[self.alive])
+        absolute = np.abs(self.evaluate(x, y) - exact)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return absolute, np.where(exact > 0, absolute / exact, 0)
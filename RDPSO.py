@@ -1,38 +1,10 @@
 # Adapted from https://github.com/xrl2408/E2RPSO/tree/main
 # Original author: xrl2408
 
-import math
-from Continuous_grid import visualize_grid
+from Continuous_grid import InteractiveSink
 import random
 import RDPSO_util
-
-def check_target_detection(grid):
-    """Check if an agent has detected any target
-
-    Args:
-        grid (Grid): Instance of Grid
-
-    Returns:
-        Bool: True if a target is detected, False otherwise. 
-    """
-    for agent in grid.agents:
-        for i, target in enumerate(grid.targets):
-            if target is None:  # Skip already found targets
-                continue
-                
-            target_x, target_y, target_radius = target
-            
-            # Calculate distance between agent and target centers
-            distance = math.sqrt((agent.x - target_x) ** 2 + (agent.y - target_y) ** 2)
-            
-            # Check if agent's detection radius overlaps with target
-            if distance < agent.radius + target_radius:
-                agent.targets_found += 1
-                grid.remove_target(target_x, target_y, target_radius)
-                grid.targets[i] = None  # Mark target as found
-                return True
-        
-    return False
+from Collision import AVOIDANCE
 
 def move(agent, dx, dy, grid):
     """Move agent by (dx,dy) if there is no collision
@@ -50,7 +22,7 @@ def move(agent, dx, dy, grid):
     new_x = agent.x + dx
     new_y = agent.y + dy
     # Check if new position would cause collision
-    if not (RDPSO_util.is_collision(grid, new_x, new_y, agent.radius) or RDPSO_util.is_collision_agents(agent, grid, new_x, new_y, agent.radius)):
+    if not RDPSO_util.is_collision_move(agent, grid, new_x, new_y):
 
         # Update agent position
         agent.setcoords(new_x, new_y)        
@@ -58,27 +30,33 @@ def move(agent, dx, dy, grid):
 
     return False
 
-def RDPSO(grid, max_steps = 1000, step_size = 2):
+def RDPSO(grid, max_steps = 1000, step_size = 2, sink = None, avoidance = 'probe', synchronous = False):
     """Function controlling the E2RPSO process
 
     Args:
         grid (Grid): Instance of the grid
         max_steps (int): maximum amount of steps. Defaults to 1000.
         step_size (int): maximum step size. Defaults to 2.
+        sink (NullSink, CheckpointSink, InteractiveSink, optional): receives the frames of the run. Defaults to InteractiveSink().
+        avoidance (str, optional): obstacle avoidance when a move is blocked, 'probe' tries up to 180 headings, 'field' slides along the obstacle. Defaults to 'probe'.
+        synchronous (bool, optional): If True, all agents are updated at once from the state at the start of the step, 
+            see RDPSO_util.step_synchronous. If False, the agents are updated one after the other. Defaults to False.
 
     Returns:
         int: number of steps needed
         int: number of targets found
         float: distance covered by all the agents
     """
+    if sink is None:
+        sink = InteractiveSink()
     total_targets = len(grid.targets)
     targets_found = 0
     # Side length of square map
     V_LIMIT = step_size
+    avoid = AVOIDANCE[avoidance]
     
     # initial
     agents, goal_list_x, goal_list_y, gx, gy, gbest = RDPSO_util.init_RDPSO(step_size,grid)
-    nr_of_agents = len(agents)
     fugitive_list = [0] * len(agents)
     
     # PSO parameters
@@ -95,66 +73,63 @@ def RDPSO(grid, max_steps = 1000, step_size = 2):
         
         # find and change fugitive
         if steps % 20 == 0 and steps > 0:
-            best_agent_indices = sorted(range(len(agents)), key=lambda i: agents[i].pbest, reverse=True)[:int(nr_of_agents / 3)]
-            for i in range(nr_of_agents):
-                if i in best_agent_indices:
-                    fugitive_list[i] = 1
-                else:
-                    fugitive_list[i] = 0
+            fugitive_list = RDPSO_util.select_fugitives(grid.agent_array)
                                 
-        # Traverse all robots
-        for agent_idx, agent in enumerate(agents):
+        if synchronous:
+            gbest, gx, gy = RDPSO_util.step_synchronous(grid, fugitive_list, gx, gy, gbest, goal_list_x, goal_list_y, 
+                                                        w, V_LIMIT, avoid, c1, c2)
+        else:
+            # Traverse all robots
+            for agent_idx, agent in enumerate(agents):
 
-            r1 = random.uniform(0, 1)
-            r2 = random.uniform(0, 1)
+                r1 = random.uniform(0, 1)
+                r2 = random.uniform(0, 1)
                                                                                                           
-            # Unit speed for x and y component
-            xp, yp, xg, yg = RDPSO_util.Unit_speed(agent, gx, gy)
+                # Unit speed for x and y component
+                xp, yp, xg, yg = RDPSO_util.Unit_speed(agent, gx, gy)
 
-            # update velocity , using RDPSO                                                                       
-            if fugitive_list[agent_idx] == 0:
-                v_x = w * agent.Vx + r1 * c1 * xp + c2 * r2 * xg
-                v_y = w * agent.Vy + r1 * c1 * yp + c2 * r2 * yg 
+                # update velocity , using RDPSO                                                                       
+                if fugitive_list[agent_idx] == 0:
+                    v_x = w * agent.Vx + r1 * c1 * xp + c2 * r2 * xg
+                    v_y = w * agent.Vy + r1 * c1 * yp + c2 * r2 * yg 
 
-            else :
-                v_x = (1+random.uniform(-1, 1))*w * agent.Vx
-                v_y = (1+random.uniform(-1, 1))*w * agent.Vy
+                else :
+                    v_x = (1+random.uniform(-1, 1))*w * agent.Vx
+                    v_y = (1+random.uniform(-1, 1))*w * agent.Vy
                                                                                                                                 
-            # limit max velocity
-            v_x *= 100
-            v_y *= 100
-            v_x, v_y = RDPSO_util.Limit_maxVelocity(v_x, v_y, V_LIMIT)          
+                # limit max velocity
+                v_x *= 100
+                v_y *= 100
+                v_x, v_y = RDPSO_util.Limit_maxVelocity(v_x, v_y, V_LIMIT)          
 
-            # update position
-            if not move(agent, v_x, v_y, grid):
-                new_x, new_y, v_x, v_y = RDPSO_util.avoidObstacle(agent, v_x, v_y, V_LIMIT, grid)
-                agent.setcoords(new_x, new_y)
+                # update position
+                if not move(agent, v_x, v_y, grid):
+                    new_x, new_y, v_x, v_y = avoid(agent, v_x, v_y, V_LIMIT, grid)
+                    agent.setcoords(new_x, new_y)
 
-            agent.setVelocity(v_x, v_y)
+                agent.setVelocity(v_x, v_y)
 
                             
-            # update Pbest & Gbest
-            gbest, gx, gy = RDPSO_util.update_GbestPbest(agent, gx, gy, gbest, goal_list_x, goal_list_y)
+                # update Pbest & Gbest
+                gbest, gx, gy = RDPSO_util.update_GbestPbest(agent, gx, gy, gbest, goal_list_x, goal_list_y)
+
 
         grid.pos_change()
-        if check_target_detection(grid):
-            targets_found += 1
+        found = grid.detect_targets()
+        targets_found += len(found)
 
         # Optional: Visualize grid state periodically
         if steps % 10 == 0:
-            visualize_grid(grid, steps, name='RDPSO')
+            sink.emit(grid, steps, name='RDPSO')
 
         if targets_found == total_targets:
             break
-        else:
-            a, b, c = zip(*[(ai, bi, ci) for ai, bi, ci in zip(grid.targets, goal_list_x, goal_list_y) if ai is not None])
-            grid.targets = list(a)
-            goal_list_x = list(b)
-            goal_list_y = list(c)
+        elif found:
+            goal_list_x, goal_list_y = grid.target_store.positions()
 
     total_distance = grid.total_distance_covered()
         
-    visualize_grid(grid, steps, done = True, name='RDPSO')
+    sink.emit(grid, steps, done = True, name='RDPSO')
         
     return steps, targets_found, total_distance
 
@@ -4,23 +4,10 @@
 
 import random
 import math
-
-def getFitness(gx, gy, x, y):
-    """Function that computes the fitness function
-
-    Args:
-        gx (float): x coordinate of the desired state
-        gy (float): y coordinate of the desired state
-        x (float): x coordinate of the agent
-        y (float): y coordinate of the agent
-
-    Returns:
-        float: value of fitness
-    """
-    dis = math.sqrt((gx - x) * (gx - x) + (gy - y) * (gy - y))
-    sq = math.sqrt(dis)
-
-    return math.sqrt(sq)
+import numpy as np
+import Fitness
+from Velocity import Limit_maxVelocity_all, Unit_speed_all
+from Collision import is_collision, is_collision_agents, is_collision_move, avoidObstacle, move_agents
 
 # update Gbest Pbest
 def update_GbestPbest(r, Gx, Gy, Gbest, goal_list_x, goal_list_y):
@@ -39,25 +26,8 @@ def update_GbestPbest(r, Gx, Gy, Gbest, goal_list_x, goal_list_y):
         float: x coordinate of the global best
         float: y coorindate of the global best
         float: value of the global best
-    """   
-    gx = Gx
-    gy = Gy
-    gbest = Gbest
-    f = 0
-    for ttt in range(len(goal_list_x)):
-        tmp_f = getFitness(goal_list_x[ttt], goal_list_y[ttt], r.x, r.y)
-        f += tmp_f
-
-    if f <= r.pbest:
-        r.pbest = f
-        r.px = r.x
-        r.py = r.y
-    if f <= gbest:
-        gbest = f
-        gx = r.px
-        gy = r.py
-
-    return gbest, gx, gy
+    """
+    return Fitness.update_best(r.array, r.index, Gx, Gy, Gbest, goal_list_x, goal_list_y)
 
 # limit max velocity
 def Limit_maxVelocity(v_x, v_y, v_limit):
@@ -106,104 +76,92 @@ def Unit_speed(r, gx, gy):
         yg = yg / g_len
     return xp, yp, xg, yg
 
-def is_collision(grid, x, y, radius):
-    """Check if a point (x,y) with given radius collides with any obstacle
+def update_GbestPbest_all(agent_array, Gx, Gy, Gbest, goal_list_x, goal_list_y):
+    """Updates the personal best of all agents at once and the global best across all agents,
+    with the same outcome as calling update_GbestPbest for the agents in order
 
     Args:
-        grid (Grid): instance of Grid
-        x (float): x coordinate of the agent
-        y (float): y coordinate of the agent
-        radius (int): sensing range of the agent
+        agent_array (AgentArray): the agents
+        Gx (float): x coordinate of the global best
+        Gy (float): y coorindate of the global best
+        Gbest (float): value of the global best
+        goal_list_x (list): list containing the x coordinates of all goals
+        goal_list_y (list): list containing the y coordinates of all goals
 
     Returns:
-        Bool: True if there is a collision, false otherwise
-    """    # Check bounds
-    if x - radius < 0 or x + radius > grid.width or y - radius < 0 or y + radius > grid.height:
-        return True
-
-    # Check obstacles
-    for obs_x, obs_y, obs_w, obs_h in grid.obstacles:   
-        
-        # Calculate closest point on rectangle to circle center
-        closest_x = max(obs_x - obs_w, min(x, obs_x + obs_w))
-        closest_y = max(obs_y - obs_h, min(y, obs_y + obs_h))
-        
-        # Calculate distance between closest point and circle center
-        distance = math.sqrt((x - closest_x) ** 2 + (y - closest_y) ** 2)
-        
-        # Check collision
-        if distance < radius:
-            return True
-    
-    return False
-
-def is_collision_agents(agent_self, grid, x, y, radius):
-    """Check if a point (x,y) with given radius collides with any agent
+        float: value of the global best
+        float: x coordinate of the global best
+        float: y coorindate of the global best
+    """
+    return Fitness.update_bests(agent_array, Gx, Gy, Gbest, goal_list_x, goal_list_y)
+
+def select_fugitives(agent_array):
+    """Function that marks the third of the agents with the highest personal best as fugitives.
+    Uses a partial selection, the agents do not need to be sorted.
 
     Args:
-        agent_self (Agent): instacne of class Agent
-        grid (Grid): instance of a grid
-        x (float): x coordinate of the agent
-        y (float): y coordinate of the agent
-        radius (int): sensing range of the agent
+        agent_array (AgentArray): the agents
 
     Returns:
-        Bool: True if there is a collision, false otherwise
-    """    # Check bounds
-    if x - radius < 0 or x + radius > grid.width or y - radius < 0 or y + radius > grid.height:
-        return True
-
-    # Check obstacles
-    for agent in grid.agents: 
-        if agent != agent_self:
-            ag_x = agent.x
-            ag_y = agent.y
-            ag_w = agent.half_size 
-            ag_h = agent.half_size  
-            
-            # Calculate closest point on rectangle to circle center
-            closest_x = max(ag_x - ag_w, min(x, ag_x + ag_w))
-            closest_y = max(ag_y - ag_h, min(y, ag_y + ag_h))
-            
-            # Calculate distance between closest point and circle center
-            distance = math.sqrt((x - closest_x) ** 2 + (y - closest_y) ** 2)
-            
-            # Check collision
-            if distance < radius:
-                return True
-        
-    return False
-
-# Avoid obstacle
-def avoidObstacle(r, v_x, v_y, V_LIMIT, grid):
-    """Function that computes how to avoid the obstacle
+        array: boolean array, True for the fugitives
+    """
+    nr_of_fugitives = int(agent_array.count / 3)
+    fugitive_list = np.zeros(agent_array.count, dtype=bool)
+    if nr_of_fugitives > 0:
+        fugitive_list[np.argpartition(-agent_array.pbest, nr_of_fugitives - 1)[:nr_of_fugitives]] = True
+    return fugitive_list
+
+def step_synchronous(grid, fugitive_list, gx, gy, gbest, goal_list_x, goal_list_y, w, V_LIMIT, avoid, c1, c2):
+    """One synchronous RDPSO step of the whole swarm.
+    All agents compute their velocity from the state at the start of the step, so every agent sees the same global best.
+    Normal agents and fugitives are updated with array masks, all moves are then resolved in one batch with move_agents,
+    the agents that are blocked call avoid one at a time, and the bests are updated for all agents at once.
+    The random numbers come from np.random instead of random, so a run differs from the asynchronous update.
 
     Args:
-        r (Agent): instance of Agent
-        v_x (float): x velocity
-        v_y (float): y velocity
+        grid (Grid): Instance of the grid
+        fugitive_list (array): boolean array, True for the fugitives
+        gx (float): x coordinate of the global best
+        gy (float): y coordinate of the global best
+        gbest (float): value of the global best
+        goal_list_x (list): list containing the x coordinates of all goals
+        goal_list_y (list): list containing the y coordinates of all goals
+        w (float): inertia weight
         V_LIMIT (float): maximum velocity
-        grid (Grid): instance of a grid
+        avoid (function): obstacle avoidance for the blocked agents
+        c1 (float): learning constant towards the personal best
+        c2 (float): learning constant towards the global best
 
     Returns:
-        float: New computed values to avoid obstacles
+        float: value of the global best
+        float: x coordinate of the global best
+        float: y coorindate of the global best
     """
-    # x,y direction
-    angle_list = [10, -10, 20, -20, 30, -30, 40, -40, 50, -50, 60, -60, 70, -70, 80, -80, 90, -90, 100, -100,
-                    110, -110, 120, -120, 130, -130, 140, -140, 150, -150, 160, -160, 170, -170, 180, -180]
-    
-    for magnitude in [V_LIMIT * f for f in [1.0, 0.8, 0.6, 0.4, 0.2]]:
-        for angle in angle_list:
-            theta = math.atan2(v_y, v_x) + math.radians(angle)
-            ndx = math.cos(theta) * magnitude
-            ndy = math.sin(theta) * magnitude
-
-            new_x = r.x + ndx
-            new_y = r.y + ndy
-
-            if not (is_collision(grid, new_x, new_y, r.radius) or is_collision_agents(r, grid, new_x, new_y, r.radius)):
-                return new_x, new_y, ndx, ndy
-    return r.x, r.y, 0.0, 0.0
+    a = grid.agent_array
+    r1, r2 = np.random.uniform(0, 1, size=(2, a.count))
+    f_x, f_y = np.random.uniform(-1, 1, size=(2, a.count))
+
+    # Unit speed for x and y component
+    xp, yp, xg, yg = Unit_speed_all(a, gx, gy)
+
+    # update velocity , using RDPSO
+    v_x = np.where(fugitive_list, (1 + f_x) * w * a.Vx, w * a.Vx + r1 * c1 * xp + c2 * r2 * xg)
+    v_y = np.where(fugitive_list, (1 + f_y) * w * a.Vy, w * a.Vy + r1 * c1 * yp + c2 * r2 * yg)
+
+    # limit max velocity
+    v_x, v_y = Limit_maxVelocity_all(v_x * 100, v_y * 100, V_LIMIT)
+
+    # update position, the blocked agents avoid the obstacle one at a time
+    moved = move_agents(grid, v_x, v_y)
+    for agent_idx in np.flatnonzero(~moved):
+        agent = a.agents[agent_idx]
+        new_x, new_y, v_x[agent_idx], v_y[agent_idx] = avoid(agent, v_x[agent_idx], v_y[agent_idx], V_LIMIT, grid)
+        agent.setcoords(new_x, new_y)
+
+    a.setVelocity(v_x, v_y)
+
+    # update Pbest & Gbest
+    return update_GbestPbest_all(a, gx, gy, gbest, goal_list_x, goal_list_y)
 
 def init_RDPSO(step_size,grid):
     """Init function for the DPSO algorithm
@@ -224,30 +182,13 @@ def init_RDPSO(step_size,grid):
     for agent in grid.agents:
         agent.setVelocity(random.uniform(0, step_size), random.uniform(-step_size, step_size))
 
-    goal_list_x = []
-    goal_list_y = []
-    for x, y, _ in grid.targets:
-        goal_list_x.append(x)
-        goal_list_y.append(y)
+    goal_list_x, goal_list_y = grid.target_store.positions()
 
     gbest = 200000
     gx = 0
     gy = 0
 
-    for agent in grid.agents:
-        f = 0
-        for ttt in range(len(goal_list_x)):
-            tmp_f = getFitness(goal_list_x[ttt], goal_list_y[ttt], agent.x, agent.y)
-            f += tmp_f
-
-        if f < agent.pbest:
-            agent.px = agent.x
-            agent.py = agent.y
-            agent.pbest = f
-            if f < gbest:
-                gbest = f
-                gx = agent.px
-                gy = agent.py
+    gbest, gx, gy = Fitness.init_bests(grid.agent_array, gx, gy, gbest, goal_list_x, goal_list_y)
 
     return grid.agents,goal_list_x,goal_list_y, gx, gy, gbest
 
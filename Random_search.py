@@ -1,66 +1,8 @@
-from Continuous_grid import Grid, Agent, visualize_grid
+from Continuous_grid import Grid, Agent, InteractiveSink
 import random
 import math
-
-def check_target_detection(grid):
-    """Check if an agent has detected any target
-
-    Args:
-        grid (Grid): Instance of Grid
-
-    Returns:
-        Bool: True if a target is detected, False otherwise. 
-    """
-    for agent in grid.agents:
-        for i, target in enumerate(grid.targets):
-            if target is None: 
-                 # Skip already found targets
-                continue
-            target_x, target_y, target_radius = target
-            
-            # Calculate distance between agent and target centers
-            distance = math.sqrt((agent.x - target_x) ** 2 + (agent.y - target_y) ** 2)
-            
-            # Check if agent's detection radius overlaps with target
-            if distance < grid.agents[0].radius + grid.target_half_size + 3:
-                agent.targets_found += 1
-                grid.remove_target(target_x, target_y, target_radius)
-                grid.targets[i] = None  # Mark target as found
-                return True
-        
-    return False
-
-def is_collision( grid, x, y, radius):
-    """Check if a point (x,y) with given radius collides with any obstacle
-
-    Args:
-        grid (Grid): instance of Grid
-        x (float): x coordinate of the agent
-        y (float): y coordinate of the agent
-        radius (int): sensing range of the agent
-
-    Returns:
-        Bool: True if there is a collision, false otherwise
-    """
-    # Check bounds
-    if x - radius < 0 or x + radius > grid.width or y - radius < 0 or y + radius > grid.height:
-        return True
-    
-    # Check obstacles
-    for obs_x, obs_y, obs_w, obs_h in grid.obstacles:
-        
-        # Calculate closest point on rectangle to circle center
-        closest_x = max(obs_x - obs_w, min(x, obs_x + obs_w))
-        closest_y = max(obs_y - obs_h, min(y, obs_y + obs_h))
-        
-        # Calculate distance between closest point and circle center
-        distance = math.sqrt((x - closest_x) ** 2 + (y - closest_y) ** 2)
-        
-        # Check collision
-        if distance < radius:
-            return True
-    
-    return False
+import numpy as np
+from Collision import is_collision_move
 
 def move(agent, grid, step_size):
     """Function that moves an agent if there is no collision
@@ -80,47 +22,87 @@ def move(agent, grid, step_size):
         new_y = agent.y + dy
         
         # Check if new position would cause collision
-        if not is_collision(grid, new_x, new_y, agent.radius):
+        if not is_collision_move(agent, grid, new_x, new_y, agents=False):
             agent.setcoords(new_x, new_y) 
             return True
         
         return False
 
-def random_search(grid, max_steps=1000, step_size=2):
+def move_all(grid, dx, dy):
+    """Function that moves all agents at once, every agent whose move collides with the border or an obstacle stays in place.
+    The agents do not block each other, like in move.
+
+    Args:
+        grid (Grid): instance of a Grid
+        dx (array): proposed x steps of the agents
+        dy (array): proposed y steps of the agents
+
+    Returns:
+        array: boolean array of the agents that moved
+    """
+    agent_array = grid.agent_array
+    new_x = agent_array.x + dx
+    new_y = agent_array.y + dy
+
+    blocked = np.zeros(agent_array.count, dtype=bool)
+    for radius in np.unique(agent_array.radius):
+        same = agent_array.radius == radius
+        blocked[same] = grid.obstacle_set.query(np.column_stack((new_x[same], new_y[same])), radius)
+
+    agent_array.setcoords(new_x, new_y, ~blocked)
+    return ~blocked
+
+def random_search(grid, max_steps=1000, step_size=2, sink=None, batched=False, block_size=100):
     """Function that controls the process of random search
 
     Args:
         grid (Grid): Instance of the grid
         max_steps (int): maximum amount of steps. Defaults to 1000.
         step_size (int): maximum step size. Defaults to 2.
+        sink (NullSink, CheckpointSink, InteractiveSink, optional): receives the frames of the run. Defaults to InteractiveSink().
+        batched (bool, optional): If True, the headings of all agents are drawn for block_size steps at once from a 
+            NumPy Generator seeded with grid.seed, and all moves of a step are checked in one query, see move_all. 
+            If False, the agents draw a heading and move one after the other. Defaults to False.
+        block_size (int, optional): number of steps of headings drawn at once when batched. Defaults to 100.
 
     Returns:
         int: number of steps needed
         int: number of targets found
         float: distance covered by all the agents
     """
+    if sink is None:
+        sink = InteractiveSink()
     total_targets = len(grid.targets)
     targets_found = 0
     steps = 0
     
-    visualize_grid(grid, 0)
+    sink.emit(grid, 0)
+    if batched:
+        rng = np.random.default_rng(grid.seed)
 
     for steps in range(max_steps):
-        # Move each agent in a random direction
-        for agent in grid.agents:
-            # Generate random movement direction
-            
-            # Try to move the agent
-            move(agent, grid, step_size)
-            
-            # Check if agent has found a target
+        if batched:
+            # Draw the headings of all agents for the next block of steps
+            if steps % block_size == 0:
+                angle = rng.uniform(0, 2 * math.pi, size=(block_size, grid.agent_array.count))
+                block_x = step_size * np.cos(angle)
+                block_y = step_size * np.sin(angle)
+            move_all(grid, block_x[steps % block_size], block_y[steps % block_size])
+        else:
+            # Move each agent in a random direction
+            for agent in grid.agents:
+                # Generate random movement direction
+                
+                # Try to move the agent
+                move(agent, grid, step_size)
+                
+                # Check if agent has found a target
 
         grid.pos_change()
-        if check_target_detection(grid):
-            targets_found += 1
+        targets_found += len(grid.detect_targets(margin = 3))
         # Optional: Visualize grid state at each step
         if steps % 50 == 0:     
-            visualize_grid(grid, steps, name='Random')
+            sink.emit(grid, steps, name='Random')
         if targets_found == total_targets:
             break
     
@@ -129,6 +111,6 @@ def random_search(grid, max_steps=1000, step_size=2):
 
     
     # Visualize the final grid state
-    visualize_grid(grid, steps, name='Random')
+    sink.emit(grid, steps, done = True, name='Random')
     
     return steps, targets_found, total_distance
@@ -0,0 +1,50 @@
+import numpy as np
+
+def Limit_maxVelocity_all(v_x, v_y, v_limit):
+    """Function that clips all velocities that exceed the limit at once, like Limit_maxVelocity of the algorithms
+
+    Args:
+        v_x (array): Current x velocities
+        v_y (array): Current y velocities
+        v_limit (float): maximum value the velocity may have. 
+
+    Returns:
+        array: checked velocities for x
+        array: checked velocities for y
+    """
+    over = (np.abs(v_x) > v_limit / 2) | (np.abs(v_y) > v_limit / 2)
+    k = np.sqrt(v_x * v_x + v_y * v_y)
+    scale = np.where(over, v_limit / np.where(over, k, 1), 1)
+    return v_x * scale, v_y * scale
+
+def unit_vector(dx, dy):
+    """Function that normalizes many vectors at once, zero vectors stay zero
+
+    Args:
+        dx (array): x components
+        dy (array): y components
+
+    Returns:
+        array: x components of the unit vectors
+        array: y components of the unit vectors
+    """
+    length = np.sqrt(dx ** 2 + dy ** 2)
+    length[length == 0] = 1
+    return dx / length, dy / length
+
+def Unit_speed_all(agent_array, gx, gy):
+    """Compute normalized directional vectors of all agents toward their personal best
+    and the global best from their current position.
+
+    Args:
+        agent_array (AgentArray): the agents
+        gx (float): x coordinate of the global best
+        gy (float): y cooridnate of the global best
+
+    Returns:
+        tuple: arrays of unit vectors toward personal best (xp, yp) and global best (xg, yg).
+    """
+    a = agent_array
+    xp, yp = unit_vector(a.px - a.x, a.py - a.y)
+    xg, yg = unit_vector(gx - a.x, gy - a.y)
+    return xp, yp, xg, yg
@@ -1,8 +1,10 @@
 import numpy as np
-import math
 import random
-from Continuous_grid import visualize_grid, Grid
+from Continuous_grid import InteractiveSink
 import dPSO_util
+import Fitness
+from Velocity import Limit_maxVelocity_all, unit_vector
+from Collision import AVOIDANCE, cell_codes, cell_pairs, is_collision, is_collision_move, query_agents, avoidObstacle
 
 class Particle:
     def __init__(self, x, y, p_radius):
@@ -43,42 +45,62 @@ class Particle:
         self.vy = vy
 
 class Swarm:
-    def __init__(self, agent, grid, num_particles=10, sigma=3):
-        """Initialization function of the Swarm class
+    def __init__(self, agents, grid, num_particles=10, sigma=3):
+        """Initialization function of the Swarm class.
+        The particles of the sub-swarms of all agents are kept in arrays of shape (agents, particles),
+        row i holds the sub-swarm of agent i. Slots that could not be filled are marked invalid.
 
         Args:
-            agent (Agent): Agent objects from class Agent in Continuous_grid.py
+            agents (list): Agent objects from class Agent in Continuous_grid.py
             grid (Grid): Instance of the grid
-            num_particles (int): number of particles. Defaults to 10.
+            num_particles (int): number of particles per agent. Defaults to 10.
             sigma (int): representen the standard deviation for the nromal distribution. Defaults to 3.
         """
-        self.agent = agent
-        self.particles = []
-        self.gx = agent.x
-        self.gy = agent.y
-        self.gbest = np.inf
+        self.agents = agents
+        shape = (len(agents), num_particles)
+        self.x = np.zeros(shape)
+        self.y = np.zeros(shape)
+        self.vx = np.zeros(shape)
+        self.vy = np.zeros(shape)
+        self.px = np.zeros(shape)
+        self.py = np.zeros(shape)
+        self.pbest = np.full(shape, np.inf)
+        self.valid = np.zeros(shape, dtype=bool)
+        self.count = np.zeros(len(agents), dtype=int)
+        self.radius = np.array([agent.radius for agent in agents], dtype=float)
+        self.gx = np.array([agent.x for agent in agents], dtype=float)
+        self.gy = np.array([agent.y for agent in agents], dtype=float)
+        self.gbest = np.full(len(agents), np.inf)
         self.sigma = sigma
-        self.initialize_particles(grid, num_particles)
+        for i in range(len(agents)):
+            self.initialize_particles(grid, i, num_particles)
 
-    def initialize_particles(self, grid, num_particles):
-        """Function that initializes the particles
+    def initialize_particles(self, grid, i, num_particles):
+        """Function that initializes the particles of the sub-swarm of agent i
 
         Args:
             grid (Grid): Instance of the grid
+            i (int): index of the agent
             num_particles (int): number of particles_
         """
-        #self.agent.grid = None  # will be set externally
+        agent = self.agents[i]
         attempts = 0
-        while len(self.particles) < num_particles and attempts < num_particles * 10:
-            x = np.random.normal(self.agent.x, self.sigma)
-            y = np.random.normal(self.agent.y, self.sigma)
-            if not (dPSO_util.is_collision(grid, x, y, self.agent.radius) or
-                    dPSO_util.is_collision_particles(self, None, grid, x, y, self.agent.radius)):
-                self.particles.append(Particle(x, y, self.agent.radius))
+        while self.count[i] < num_particles and attempts < num_particles * 10:
+            x = np.random.normal(agent.x, self.sigma)
+            y = np.random.normal(agent.y, self.sigma)
+            if not (is_collision(grid, x, y, agent.radius) or
+                    dPSO_util.is_collision_particles(self, i, None, grid, x, y, agent.radius)):
+                j = self.count[i]
+                self.x[i, j] = self.px[i, j] = x
+                self.y[i, j] = self.py[i, j] = y
+                self.valid[i, j] = True
+                self.count[i] += 1
             attempts += 1
 
-    def update_particles(self, grid, V_LIMIT, goal_list_x, goal_list_y, c1, c2, c3=1, c4=1, w=0.5, max_dis = 8):
-        """Function that updates the particle function on the grid
+    def update_particles(self, grid, V_LIMIT, goal_list_x, goal_list_y, c1, c2, c3=1, c4=1, w=0.5, max_dis = 8, avoid = avoidObstacle):
+        """Function that updates the particles of all sub-swarms at once.
+        The velocities, the attraction to the agent and the clamping are computed for all particles together,
+        the moves are tested in one batch and the particles that are blocked call avoid one at a time.
 
         Args:
             grid (Grid): instance of the grid
@@ -91,74 +113,145 @@ class Swarm:
             c4 (int, optional): learning constant. Defaults to 1.
             w (float, optional): inertia weight. Defaults to 0.5.
             max_dis (int, optional): Used for computing the distance between the agent and the particle. Defaults to 8.
+            avoid (function, optional): obstacle avoidance when a move is blocked. Defaults to avoidObstacle.
 
         Returns:
-            float: the coordinate of the personal best
+            array: x coordinates of the best particle of every sub-swarm
+            array: y coordinates of the best particle of every sub-swarm
         """
-        for p in self.particles:    
-            r1 = random.uniform(0, 1)
-            r2 = random.uniform(0, 1)
-            r3 = random.uniform(0, 1)
-            r4 = random.uniform(0, 1)
-
-            # Unit speed for x and y component
-            xp, yp, xg, yg = dPSO_util.Unit_speed(p, self.gx, self.gy)
+        r1, r2, r3 = np.random.uniform(0, 1, size=(3,) + self.x.shape)
+        agent_x = grid.agent_array.x[:, None]
+        agent_y = grid.agent_array.y[:, None]
 
-            v_x = w * p.vx + c1 * r1 * xp + c2 * r2 * xg
-            v_y = w * p.vy + c1 * r1 * yp + c2 * r2 * yg
+        # Unit speed for x and y component
+        xp, yp = unit_vector(self.px - self.x, self.py - self.y)
+        xg, yg = unit_vector(self.gx[:, None] - self.x, self.gy[:, None] - self.y)
 
-            dis = math.hypot(self.agent.x - p.x, self.agent.y - p.y)
-            if dis > max_dis:
-                v_x += c3 * r3 * (1 + dis - max_dis) * ((self.agent.x - p.x)/dis)
-                v_y += c3 * r3 * (1 + dis - max_dis) * ((self.agent.y - p.y)/dis)
+        v_x = w * self.vx + c1 * r1 * xp + c2 * r2 * xg
+        v_y = w * self.vy + c1 * r1 * yp + c2 * r2 * yg
 
-            v_x *= 100
-            v_y *= 100
-            v_x, v_y = dPSO_util.Limit_maxVelocity(v_x, v_y, V_LIMIT*2)          
+        # Pull the particles that are too far from their agent back
+        dis = np.hypot(agent_x - self.x, agent_y - self.y)
+        far = dis > max_dis
+        pull = np.where(far, c3 * r3 * (1 + dis - max_dis) / np.where(far, dis, 1), 0)
+        v_x += pull * (agent_x - self.x)
+        v_y += pull * (agent_y - self.y)
 
-            # update position
-            if not move(self, p, v_x, v_y, grid):
-                new_x, new_y, v_x, v_y = dPSO_util.avoidObstacle(p, v_x, v_y, V_LIMIT*2, grid)
-                p.setcoords(new_x, new_y)
+        v_x, v_y = Limit_maxVelocity_all(v_x * 100, v_y * 100, V_LIMIT*2)
 
-            p.setVelocity(v_x, v_y)
+        # update position
+        moved = self.move_particles(grid, v_x, v_y)
+        for i, j in zip(*np.nonzero(self.valid & ~moved)):
+            p = Particle(self.x[i, j], self.y[i, j], self.radius[i])
+            self.x[i, j], self.y[i, j], v_x[i, j], v_y[i, j] = avoid(p, v_x[i, j], v_y[i, j], V_LIMIT*2, grid)
 
-            self.gbest, self.gx, self.gy = dPSO_util.update_GbestPbest(p, self.gx, self.gy, self.gbest, goal_list_x, goal_list_y)
+        self.vx = np.where(self.valid, v_x, 0)
+        self.vy = np.where(self.valid, v_y, 0)
 
+        self.update_GbestPbest(grid, goal_list_x, goal_list_y)
         return self.gx, self.gy
 
-def check_target_detection(grid):
-    """Check if an agent has detected any target
+    def move_particles(self, grid, dx, dy):
+        """Move all particles by (dx,dy) at the same time, every particle whose move causes a collision stays in place.
+        The moves are tested against the obstacles, the agents and the current position of the other particles of the sub-swarm.
+        A particle that would then end up in collision with another particle's new position stays in place as well.
 
-    Args:
-        grid (Grid): Instance of Grid
+        Args:
+            grid (Grid): instance of the grid
+            dx (array): proposed x steps of the particles
+            dy (array): proposed y steps of the particles
 
-    Returns:
-        Bool: True if a target is detected, False otherwise. 
-    """
-    for agent in grid.agents:
-        for i, target in enumerate(grid.targets):
-            if target is None:  # Skip already found targets
+        Returns:
+            array: boolean array of the particles that moved
+        """
+        new_x = self.x + dx
+        new_y = self.y + dy
+        radius = np.broadcast_to(self.radius[:, None], self.x.shape)
+        blocked = ~self.valid
+
+        rows, cols = np.nonzero(self.valid)
+        for r in np.unique(self.radius):
+            same = radius[rows, cols] == r
+            points_x = new_x[rows[same], cols[same]]
+            points_y = new_y[rows[same], cols[same]]
+            blocked[rows[same], cols[same]] = (grid.obstacle_set.query(np.column_stack((points_x, points_y)), r) |
+                                               query_agents(None, grid, points_x, points_y, r))
+
+        blocked |= self.particles_hit(new_x, new_y, self.x, self.y)
+        final_x = np.where(blocked, self.x, new_x)
+        final_y = np.where(blocked, self.y, new_y)
+        moved = ~blocked & ~self.particles_hit(final_x, final_y, final_x, final_y)
+
+        self.x = np.where(moved, new_x, self.x)
+        self.y = np.where(moved, new_y, self.y)
+        return moved
+
+    def particles_hit(self, x, y, other_x, other_y):
+        """Check for every particle if a circle at (x,y) contains another particle of the same sub-swarm.
+        The candidate pairs of every sub-swarm come from a cell list with cells of the particle radius, see cell_pairs,
+        small sub-swarms test all pairs.
+
+        Args:
+            x (array): x coordinates of the circles, shape (agents, particles)
+            y (array): y coordinates of the circles, shape (agents, particles)
+            other_x (array): x coordinates of the particles, shape (agents, particles)
+            other_y (array): y coordinates of the particles, shape (agents, particles)
+
+        Returns:
+            array: boolean array of shape (agents, particles)
+        """
+        hit = np.zeros(self.x.shape, dtype=bool)
+        for i in range(self.x.shape[0]):
+            valid = np.flatnonzero(self.valid[i])
+            if len(valid) < 2:
                 continue
-                
-            target_x, target_y, target_radius = target
-            
-            # Calculate distance between agent and target centers
-            distance = math.sqrt((agent.x - target_x) ** 2 + (agent.y - target_y) ** 2)
-            
-            # Check if agent's detection radius overlaps with target
-            if distance < agent.radius + target_radius:
-                agent.targets_found += 1
-                grid.remove_target(target_x, target_y, target_radius)
-                grid.targets[i] = None  # Mark target as found
-                return True
-        
-    return False
+            radius = self.radius[i]
+            ox = other_x[i, valid]
+            oy = other_y[i, valid]
+            codes = cell_codes(np.floor(ox / radius), np.floor(oy / radius))
+            order = np.argsort(codes, kind='stable')
+            px = x[i, valid]
+            py = y[i, valid]
+            query, other = cell_pairs(codes[order], order, px, py, radius, radius)
+            keep = query != other
+            query = query[keep]
+            other = other[keep]
+
+            dx = px[query] - ox[other]
+            dy = py[query] - oy[other]
+            hit[i, valid[query[np.sqrt(dx * dx + dy * dy) < radius]]] = True
+        return hit
+
+    def update_GbestPbest(self, grid, goal_list_x, goal_list_y):
+        """Updates the personal best of all particles and the best of every sub-swarm,
+        with the same outcome as updating the particles of a sub-swarm in order
+
+        Args:
+            grid (Grid): instance of the grid
+            goal_list_x (list): list containing the x coordinates of all goals
+            goal_list_y (list): list containing the y coordinates of all goals
+        """
+        f = np.where(self.valid, Fitness.evaluate(grid.agent_array, self.x, self.y, goal_list_x, goal_list_y), np.inf)
+
+        better = self.valid & (f <= self.pbest)
+        self.pbest = np.where(better, f, self.pbest)
+        self.px = np.where(better, self.x, self.px)
+        self.py = np.where(better, self.y, self.py)
+
+        # In order, the last particle with the lowest fitness would have set the best of the sub-swarm
+        last = f.shape[1] - 1 - np.argmin(f[:, ::-1], axis=1)
+        rows = np.arange(f.shape[0])
+        f_min = f[rows, last]
+        update = np.isfinite(f_min) & (f_min <= self.gbest)
+        self.gbest = np.where(update, f_min, self.gbest)
+        self.gx = np.where(update, self.px[rows, last], self.gx)
+        self.gy = np.where(update, self.py[rows, last], self.gy)
 
 def move(swarm, agent, dx, dy, grid):
     """Move agent by (dx,dy) if there is no collision
 
     Args:
+        swarm (Swarm): the particles of all agents
         agent (Agent): instance of an Agent
         dx (float): proposed new x location
         dy (float): proposed new y location
@@ -170,9 +263,8 @@ def move(swarm, agent, dx, dy, grid):
     new_x = agent.x + dx
     new_y = agent.y + dy
     # Check if new position would cause collision
-    if not (dPSO_util.is_collision(grid, new_x, new_y, agent.radius) or 
-            dPSO_util.is_collision_agents(agent, grid, new_x, new_y, agent.radius) or
-            dPSO_util.is_collision_particles(swarm, agent, grid, new_x, new_y, agent.radius)):
+    if not (is_collision_move(agent, grid, new_x, new_y) or
+            dPSO_util.is_collision_particles(swarm, agent.index, None, grid, new_x, new_y, agent.radius)):
 
         # Update agent position
         agent.setcoords(new_x, new_y)        
@@ -181,10 +273,28 @@ def move(swarm, agent, dx, dy, grid):
     return False
 
 # --- Main DPSO Execution ---
-def dPSO(grid, max_steps = 1000, step_size = 2):
+def dPSO(grid, max_steps = 1000, step_size = 2, sink = None, avoidance = 'probe', num_particles = 10):
+    """Function controlling the dPSO process
+
+    Args:
+        grid (Grid): Instance of the grid
+        max_steps (int): maximum amount of steps. Defaults to 1000.
+        step_size (int): maximum step size. Defaults to 2.
+        sink (NullSink, CheckpointSink, InteractiveSink, optional): receives the frames of the run. Defaults to InteractiveSink().
+        avoidance (str, optional): obstacle avoidance when a move is blocked, 'probe' tries up to 180 headings, 'field' slides along the obstacle. Defaults to 'probe'.
+        num_particles (int, optional): number of particles per agent. Defaults to 10.
+
+    Returns:
+        int: number of steps needed
+        int: number of targets found
+        float: distance covered by all the agents
+    """
+    if sink is None:
+        sink = InteractiveSink()
     total_targets = len(grid.targets)
     targets_found = 0
     V_LIMIT = step_size
+    avoid = AVOIDANCE[avoidance]
 
     c1 = 0.4
     c2 = 0.9
@@ -194,24 +304,24 @@ def dPSO(grid, max_steps = 1000, step_size = 2):
     
     # initial
     agents, goal_list_x, goal_list_y, gx, gy, gbest = dPSO_util.init_dPSO(step_size,grid)
-    swarms = [Swarm(agent, grid) for agent in agents]
+    swarm = Swarm(agents, grid, num_particles)
 
     for steps in range(max_steps):
 
         w = w_upper - (steps / max_steps) * (w_upper - w_lower)
                                     
         # Traverse all robots
-        for swarm in swarms:
+        for agent in agents:
 
             r1 = random.uniform(0, 1)
             r2 = random.uniform(0, 1)
                                                                                                             
             # Unit speed for x and y component
-            xp, yp, xg, yg = dPSO_util.Unit_speed(swarm.agent, gx, gy)
+            xp, yp, xg, yg = dPSO_util.Unit_speed(agent, gx, gy)
 
             # update velocity , using RDPSO                                                                       
-            v_x = w * swarm.agent.Vx + r1 * c1 * xp + c2 * r2 * xg
-            v_y = w * swarm.agent.Vy + r1 * c1 * yp + c2 * r2 * yg 
+            v_x = w * agent.Vx + r1 * c1 * xp + c2 * r2 * xg
+            v_y = w * agent.Vy + r1 * c1 * yp + c2 * r2 * yg 
                                                                                                                                 
             # limit max velocity
             v_x *= 100
@@ -219,51 +329,36 @@ def dPSO(grid, max_steps = 1000, step_size = 2):
             v_x, v_y = dPSO_util.Limit_maxVelocity(v_x, v_y, V_LIMIT)          
 
             # update position
-            if not move(swarm, swarm.agent, v_x, v_y, grid):
-                new_x, new_y, v_x, v_y = dPSO_util.avoidObstacle(swarm.agent, v_x, v_y, V_LIMIT, grid)
-                swarm.agent.setcoords(new_x, new_y)
-
-            swarm.agent.setVelocity(v_x, v_y)
-
+            if not move(swarm, agent, v_x, v_y, grid):
+                new_x, new_y, v_x, v_y = avoid(agent, v_x, v_y, V_LIMIT, grid)
+                agent.setcoords(new_x, new_y)
 
-            spx, spy = swarm.update_particles(grid, swarms, V_LIMIT, goal_list_x, goal_list_y, c1, c2, w = w)
+            agent.setVelocity(v_x, v_y)
 
-            f = 0
-            for ttt in range(len(goal_list_x)):
-                tmp_f = dPSO_util.getFitness(goal_list_x[ttt], goal_list_y[ttt], spx, spy)
-                f += tmp_f
+        # The particles of all sub-swarms follow their agents in one batch
+        spx, spy = swarm.update_particles(grid, V_LIMIT, goal_list_x, goal_list_y, c1, c2, w = w, avoid = avoid)
 
-            if f <= swarm.agent.pbest:
-                swarm.agent.pbest = f
-                swarm.agent.px = spx
-                swarm.agent.py = spy
-            if f <= gbest:
-                gbest = f
-                gx = swarm.agent.px
-                gy = swarm.agent.py    
-            # update Pbest & Gbest
-            gbest, gx, gy = dPSO_util.update_GbestPbest(swarm.agent, gx, gy, gbest, goal_list_x, goal_list_y)
+        # update Pbest & Gbest, every agent offers the best of its sub-swarm and then its own position
+        gbest, gx, gy = Fitness.update_bests(grid.agent_array, gx, gy, gbest, goal_list_x, goal_list_y,
+                                             x = np.column_stack((spx, grid.agent_array.x)), y = np.column_stack((spy, grid.agent_array.y)))
 
 
         grid.pos_change()
-        if check_target_detection(grid):
-            targets_found += 1
+        found = grid.detect_targets()
+        targets_found += len(found)
 
         # Optional: Visualize grid state periodically
         if steps % 10 == 0:
-            visualize_grid(grid, steps, name='dPSO')
+            sink.emit(grid, steps, name='dPSO')
 
         if targets_found == total_targets:
             break
-        else:
-            a, b, c = zip(*[(ai, bi, ci) for ai, bi, ci in zip(grid.targets, goal_list_x, goal_list_y) if ai is not None])
-            grid.targets = list(a)
-            goal_list_x = list(b)
-            goal_list_y = list(c)
+        elif found:
+            goal_list_x, goal_list_y = grid.target_store.positions()
 
     total_distance = grid.total_distance_covered()
         
-    visualize_grid(grid, steps, done = True, name='dPSO')
+    sink.emit(grid, steps, done = True, name='dPSO')
         
     return steps, targets_found, total_distance
 
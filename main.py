@@ -4,8 +4,10 @@ from RDPSO import RDPSO
 from Exhaustive_search import exhaustive_search
 from Random_search import random_search
 from dPSO import dPSO
-from Continuous_grid import Grid
+from Continuous_grid import Grid, CheckpointSink
+from multiprocessing import Pool
 import csv
+import os
 
 
 #Variables
@@ -20,6 +22,8 @@ obstacle_half_size = [1, 5]
 target_half_size = 1
 seeds = [683, 430, 836]
 STEP_SIZE = 2
+WORKERS = os.cpu_count() # number of worker processes, 1 runs the sweep in this process
+SINK = CheckpointSink() # NullSink() for headless sweeps, InteractiveSink() to watch every frame
 
 algorithms = [
     ("E2RPSO", E2RPSO),
@@ -29,26 +33,71 @@ algorithms = [
     ("RDPSO", RDPSO)
 ]
 
-# Open CSV file for writing
-with open('results_table.csv', 'w', newline='') as csvfile:
-    writer = csv.writer(csvfile)
-
-    # Write header row
-    writer.writerow(['Algorithm', 'Targets_Found', 'Total_Distance', 'Steps', 'Side', 'Seed', 'Obstacles', 'Agents', 'Targets'])
+def make_jobs():
+    """Function that lists every (configuration, algorithm) job of the sweep in the order of the sequential run
 
+    Returns:
+        list: tuples of (algorithm index, side, seed, obstacles, agents, targets)
+    """
+    jobs = []
     for side in SIDE: #loop over different grid sizes
         for seed in seeds: #loop over different seeds
             for ob in obstacles: #loop over different amount of obstacles
                 for an in agent_num: #loop over different number of agents
                     for nt in num_targets: #loop over different number of targets
-                        for algo_name, algo_func in algorithms: #loop over the differetn search algorithms
-                            grid = Grid(side, ob, nt, an, agent_half_size, agent_radius, obstacle_half_size, target_half_size, seed)
-                            steps, targets_found, total_distance = algo_func(grid, T, STEP_SIZE)
-                            
-                            # Write data row
-                            writer.writerow([algo_name, targets_found, total_distance, steps, side, seed, ob, an, nt])
-                            csvfile.flush()
-                            
-                            print(f'{algo_name} -> targets_found: {targets_found}, total distance covered: {total_distance}, steps needed: {steps}')
-                            print(f'Using variables -> Side: {side}, seed: {seed}, obstacles: {ob}, agents: {an}, targets: {nt}')
-                            print("**********************************************************************************************************")
+                        for algo_idx in range(len(algorithms)): #loop over the differetn search algorithms
+                            jobs.append((algo_idx, side, seed, ob, an, nt))
+    return jobs
+
+def run_job(job):
+    """Function that runs a single simulation of the sweep.
+    The Grid reseeds random and np.random with the seed of the job, so the result does not depend on
+    which worker runs it or on the jobs that worker ran before.
+
+    Args:
+        job (tuple): (algorithm index, side, seed, obstacles, agents, targets)
+
+    Returns:
+        list: row for the results table
+    """
+    algo_idx, side, seed, ob, an, nt = job
+    algo_name, algo_func = algorithms[algo_idx]
+    grid = Grid(side, ob, nt, an, agent_half_size, agent_radius, obstacle_half_size, target_half_size, seed)
+    steps, targets_found, total_distance = algo_func(grid, T, STEP_SIZE, SINK)
+    return [algo_name, targets_found, total_distance, steps, side, seed, ob, an, nt]
+
+def write_rows(writer, csvfile, rows):
+    """Function that writes the rows of the sweep to the results table as they come in
+
+    Args:
+        writer (csv.writer): writer of the results table
+        csvfile (file): the results table, flushed after every row
+        rows (iterable): rows for the results table, in job order
+    """
+    for row in rows:
+        algo_name, targets_found, total_distance, steps, side, seed, ob, an, nt = row
+
+        # Write data row
+        writer.writerow(row)
+        csvfile.flush()
+
+        print(f'{algo_name} -> targets_found: {targets_found}, total distance covered: {total_distance}, steps needed: {steps}')
+        print(f'Using variables -> Side: {side}, seed: {seed}, obstacles: {ob}, agents: {an}, targets: {nt}')
+        print("**********************************************************************************************************")
+
+if __name__ == '__main__':
+    jobs = make_jobs()
+
+    # Open CSV file for writing
+    with open('results_table.csv', 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+
+        # Write header row
+        writer.writerow(['Algorithm', 'Targets_Found', 'Total_Distance', 'Steps', 'Side', 'Seed', 'Obstacles', 'Agents', 'Targets'])
+
+        if WORKERS > 1:
+            with Pool(WORKERS) as pool:
+                # imap hands out jobs to all workers but yields the rows in job order
+                write_rows(writer, csvfile, pool.imap(run_job, jobs))
+        else:
+            write_rows(writer, csvfile, map(run_job, jobs))